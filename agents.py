@@ -1,36 +1,39 @@
-import re, json
-from retriever import Retriever
-from prompts import RAG_PROMPT
-
-ACTION_KEYWORDS = ['block card','block my card','freeze card','dispute','raise dispute','report fraud','cancel card','get balance','balance','transfer']
-PII_PATTERNS = [
-    (re.compile(r"\b(?:\d[ -]*?){13,19}\b"), '<CARD_MASK>'),
-    (re.compile(r"\b\d{3}-\d{2}-\d{4}\b"), '<SSN_MASK>'),
-    (re.compile(r"\b\d{10}\b"), '<PHONE_MASK>'),
-    (re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"), '<EMAIL_MASK>'),
-]
+import re, json, time
+import registry, tracing
+from answer_cache import SemanticAnswerCache
+from prompts import RAG_PROMPT, NO_ANSWER
+from redaction import PII_PATTERNS, redact_pii
+from router import ROUTER, ROUTE_KEYWORDS
+import context_packer
+from context_packer import CONTEXT_TOKEN_BUDGET
+from reranker import Reranker, RERANK, RERANK_CANDIDATES
+from retriever import visible_partitions
+
+ACTION_KEYWORDS = [kw for kw, (is_action, _) in ROUTE_KEYWORDS.items() if is_action]
 
 def classify_intent(text):
-    t=text.lower()
-    for kw in ACTION_KEYWORDS:
-        if kw in t:
-            return 'action'
-    return 'faq'
-
-def redact_pii(text):
-    replacements={}
-    for pat,mask in PII_PATTERNS:
-        def repl(m):
-            key = f"{mask}_{len(replacements)+1}"
-            replacements[key]=m.group(0)
-            return key
-        text = pat.sub(repl, text)
-    return text, replacements
-
-from openai import OpenAI
-import os
+    return ROUTER.route(text)[0]
+
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient
+from concurrent.futures import ThreadPoolExecutor
+import os, asyncio, httpx
+
+LLM_MODEL = "gpt-4.1-mini"
+LLM_MAX_CONNECTIONS = 256
+# LLM calls in flight at once for one /chat/batch request
+LLM_BATCH_CONCURRENCY = 16
+# Embedding + FAISS search are CPU-bound; the async path runs them here, off the event loop
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="retrieval")
 
 client = OpenAI(api_key="sk-proj-lR1X8Cc8j-WKvikXvVdlOTXzCtnOsoVM47QNLAy6Iuuz006F-X1JkC45VCEsXL4WWukVhwgiU4T3BlbkFJqO_FWL_lw5iu0rLCd2mlxauuIpalGJzWcvGnAJNLcQI7lBJ8g__1eplnMx5_slUP9ORZ9")
+aclient = AsyncOpenAI(api_key=client.api_key, http_client=DefaultAsyncHttpxClient(
+    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)))
+
+def _llm_messages(prompt):
+    return [
+        {"role": "system", "content": "You are a banking assistant. ALWAYS return JSON with keys: answer, citations."},
+        {"role": "user",   "content": prompt}
+    ]
 
 def call_llm(prompt: str):
     """
@@ -39,11 +42,8 @@ def call_llm(prompt: str):
     """
     try:
         response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "You are a banking assistant. ALWAYS return JSON with keys: answer, citations."},
-                {"role": "user",   "content": prompt}
-            ],
+            model=LLM_MODEL,
+            messages=_llm_messages(prompt),
             temperature=0.0
         )
 
@@ -52,23 +52,227 @@ def call_llm(prompt: str):
     except Exception as e:
         return json.dumps({"answer": f"LLM error: {str(e)}", "citations": []})
 
+async def acall_llm(prompt: str):
+    """Non-blocking call_llm for the async orchestrator path."""
+    try:
+        response = await aclient.chat.completions.create(
+            model=LLM_MODEL,
+            messages=_llm_messages(prompt),
+            temperature=0.0
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        return json.dumps({"answer": f"LLM error: {str(e)}", "citations": []})
+
+async def astream_llm(prompt: str):
+    """Yield the completion's text deltas as they arrive."""
+    try:
+        stream = await aclient.chat.completions.create(
+            model=LLM_MODEL,
+            messages=_llm_messages(prompt),
+            temperature=0.0,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        yield json.dumps({"answer": f"LLM error: {str(e)}", "citations": []})
+
+class AnswerStream:
+    """Incrementally decodes the "answer" string value out of streamed JSON text.
+
+    feed() returns the newly available answer text so tokens can be shown
+    while the rest of the JSON (citations) is still being generated.
+    """
+    START = re.compile(r'"answer"\s*:\s*"')
+    ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
 
-class AnswerAgent:
     def __init__(self):
-        self.ret = Retriever()
-    def answer(self, redacted_query):
-        metas = self.ret.retrieve(redacted_query, top_k=4)
-        contexts = '\n\n'.join([f"Source: {m['source']} (chunk {m['chunk_index']})\n{m['text'][:400]}" for m in metas])
+        self.buf = ''
+        self.pos = None   # index of the next undecoded answer character
+        self.done = False
+
+    def feed(self, delta):
+        self.buf += delta
+        if self.done:
+            return ''
+        if self.pos is None:
+            m = self.START.search(self.buf)
+            if not m:
+                return ''
+            self.pos = m.end()
+        out, i, buf = [], self.pos, self.buf
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self.done = True
+                break
+            if c != '\\':
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break  # wait for the rest of the escape
+            if buf[i+1] == 'u':
+                # \uXXXX, or a \uXXXX\uXXXX surrogate pair for characters outside the BMP
+                width = 12 if buf[i+2:i+4].upper() in ('D8', 'D9', 'DA', 'DB') else 6
+                if i + width > len(buf):
+                    break
+                out.append(json.loads('"' + buf[i:i+width] + '"'))
+                i += width
+            else:
+                out.append(self.ESCAPES.get(buf[i+1], buf[i+1]))
+                i += 2
+        self.pos = i
+        return ''.join(out)
+
+
+class AnswerAgent:
+    def __init__(self, reranker=None):
+        self.cache = SemanticAnswerCache()
+        # with a reranker, RERANK_CANDIDATES chunks are retrieved and only its best few reach the prompt
+        self.reranker = reranker if reranker is not None else (Reranker() if RERANK else None)
+
+    @property
+    def ret(self):
+        # loaded on first use (or by registry.warm_up) and shared process-wide
+        return registry.get_retriever()
+
+    def _lookup(self, redacted_query, account_id=None):
+        """Embed, search, re-rank and consult the answer cache.
+
+        Returns (ret, q_emb, metas, parsed); parsed is set when no LLM call is
+        needed (cache hit, or no chunk cleared the similarity cutoff).
+        Only shared documents and those of account_id are searched.
+        """
+        ret = self.ret
+        partitions = visible_partitions(account_id)
+        if self.reranker is None:
+            q_emb, metas = ret.lookup(redacted_query, top_k=4, partitions=partitions)
+        else:
+            q_emb, metas = ret.lookup(redacted_query, top_k=RERANK_CANDIDATES, partitions=partitions)
+            metas, _ = self.reranker.rerank(redacted_query, metas)
+        return self._cached(ret, q_emb, metas)
+
+    def _lookup_many(self, redacted_queries, account_ids=None):
+        """_lookup() for a batch: one encode call, one index search per account and one re-rank call."""
+        ret = self.ret
+        partitions = [visible_partitions(a) for a in account_ids or [None] * len(redacted_queries)]
+        if self.reranker is None:
+            Q, batch = ret.lookup_many(redacted_queries, top_k=4, partitions=partitions)
+        else:
+            Q, batch = ret.lookup_many(redacted_queries, top_k=RERANK_CANDIDATES, partitions=partitions)
+            batch, _ = self.reranker.rerank_many(redacted_queries, batch)
+        return [self._cached(ret, q_emb, metas) for q_emb, metas in zip(Q, batch)]
+
+    def _cached(self, ret, q_emb, metas):
+        if not metas:
+            # nothing clears the similarity cutoff or BM25's minimum, so the prompt would only yield the fallback answer
+            return ret, q_emb, metas, {"answer": NO_ANSWER, "citations": []}
+        with tracing.span("answer_cache"):
+            return ret, q_emb, metas, self.cache.lookup(q_emb, [m['id'] for m in metas], ret.version)
+
+    @staticmethod
+    @tracing.traced("build_prompt")
+    def build_prompt(redacted_query, metas, budget=CONTEXT_TOKEN_BUDGET):
+        # neighbouring chunks merged, overlaps and duplicates dropped, best passages first within budget tokens
+        contexts = context_packer.format_contexts(context_packer.pack(metas, budget))
         prompt = RAG_PROMPT.format(contexts=contexts, query=redacted_query)
-        llm_out = call_llm(prompt)
+        # next to the rerank and llm timings, so a smaller prompt can be weighed against the re-ranking cost
+        tracing.annotate("prompt_tokens", context_packer.count_tokens(prompt))
+        return prompt
+
+    @tracing.traced("parse_json")
+    def _parse(self, llm_out, llm_s, ret, q_emb, metas):
         try:
             parsed = json.loads(llm_out)
         except:
-            parsed = {"answer":"LLM failed to produce JSON","citations":[]}
-        return parsed, metas
+            return {"answer":"LLM failed to produce JSON","citations":[]}
+        if not str(parsed.get("answer", "")).startswith("LLM error"):
+            self.cache.store(q_emb, [m['id'] for m in metas], parsed, llm_s, ret.version)
+        return parsed
+
+    def answer(self, redacted_query, account_id=None):
+        ret, q_emb, metas, parsed = self._lookup(redacted_query, account_id)
+        if parsed is not None:
+            return parsed, metas
+        prompt = self.build_prompt(redacted_query, metas)
+        with tracing.span("llm") as llm:
+            llm_out = call_llm(prompt)
+        return self._parse(llm_out, llm.seconds, ret, q_emb, metas), metas
+
+    async def aanswer(self, redacted_query, account_id=None):
+        """(parsed, metas); stage timings go to the current trace (see tracing.py)."""
+        loop = asyncio.get_running_loop()
+        ret, q_emb, metas, parsed = await loop.run_in_executor(RETRIEVAL_EXECUTOR, tracing.bind(self._lookup), redacted_query, account_id)
+        if parsed is not None:
+            return parsed, metas
+        prompt = self.build_prompt(redacted_query, metas)
+        with tracing.span("llm") as llm:
+            llm_out = await acall_llm(prompt)
+        return self._parse(llm_out, llm.seconds, ret, q_emb, metas), metas
+
+    async def aanswer_many(self, redacted_queries, concurrency=LLM_BATCH_CONCURRENCY, account_ids=None):
+        """Answer a batch; yields (position, parsed, metas, timings) in completion order.
+
+        Retrieval is done once for the whole batch, then at most `concurrency`
+        LLM calls are in flight at a time. Closing or cancelling the generator
+        (the /chat/batch client went away) cancels the calls still running. Each item's timings start from the
+        shared retrieval stages and add its own llm_queue, llm and parse_json.
+        """
+        loop = asyncio.get_running_loop()
+        looked_up = await loop.run_in_executor(RETRIEVAL_EXECUTOR, tracing.bind(self._lookup_many), redacted_queries, account_ids)
+        gate = asyncio.Semaphore(concurrency)
+
+        async def one(i, query, ret, q_emb, metas, parsed):
+            with tracing.branch() as timings:
+                if parsed is None:
+                    with tracing.span("llm_queue"):
+                        await gate.acquire()
+                    try:
+                        prompt = self.build_prompt(query, metas)
+                        with tracing.span("llm") as llm:
+                            llm_out = await acall_llm(prompt)
+                    finally:
+                        gate.release()
+                    parsed = self._parse(llm_out, llm.seconds, ret, q_emb, metas)
+            return i, parsed, metas, timings
+
+        tasks = [asyncio.create_task(one(i, q, *item)) for i, (q, item) in enumerate(zip(redacted_queries, looked_up))]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def astream(self, redacted_query, account_id=None):
+        """Async generator of events: retrieval results, answer tokens, then the parsed answer."""
+        loop = asyncio.get_running_loop()
+        ret, q_emb, metas, parsed = await loop.run_in_executor(RETRIEVAL_EXECUTOR, tracing.bind(self._lookup), redacted_query, account_id)
+        yield {"type": "retrieval", "chunks": [
+            {"source": m['source'], "chunk_index": m['chunk_index'], "score": m.get('rerank_score', m['score'])} for m in metas]}
+        if parsed is None:
+            prompt = self.build_prompt(redacted_query, metas)
+            t0 = time.perf_counter()
+            parts, answer = [], AnswerStream()
+            async for delta in astream_llm(prompt):
+                parts.append(delta)
+                text = answer.feed(delta)
+                if text:
+                    yield {"type": "token", "text": text}
+            llm_s = time.perf_counter() - t0
+            # the stream is consumed across yields, so the llm stage is recorded here rather than with a span
+            tracing.record("llm", llm_s)
+            parsed = self._parse(''.join(parts), llm_s, ret, q_emb, metas)
+        else:
+            yield {"type": "token", "text": parsed.get("answer", "")}
+        yield {"type": "answer", "response": parsed}
 
 # ActionAgent
 from tools import tool_block_card, tool_raise_dispute, tool_get_balance
+from tools import atool_block_card, atool_raise_dispute, atool_get_balance
 class ActionAgent:
     def execute(self, action_name, params):
         if action_name=='block_card':
@@ -78,3 +282,12 @@ class ActionAgent:
         if action_name=='get_balance':
             return tool_get_balance(params['account_id'])
         return {'error':'unknown action'}
+
+    async def aexecute(self, action_name, params):
+        if action_name=='block_card':
+            return await atool_block_card(params['account_id'], params['card_last4'], params.get('reason','user request'))
+        if action_name=='raise_dispute':
+            return await atool_raise_dispute(params['account_id'], params['transaction_id'], params.get('reason','dispute'))
+        if action_name=='get_balance':
+            return await atool_get_balance(params['account_id'])
+        return {'error':'unknown action'}
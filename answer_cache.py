@@ -0,0 +1,89 @@
+import copy, time, threading, numpy as np
+from collections import OrderedDict
+
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 3600  # seconds
+# cosine similarity two redacted queries need to share a cached answer
+ANSWER_CACHE_MIN_SIM = 0.95
+
+class SemanticAnswerCache:
+    """Cache of parsed LLM answers keyed by query embedding and retrieved chunks.
+
+    A lookup hits when a live entry was produced from exactly the same set of
+    chunks and its query embedding is within min_similarity of the new one,
+    so the prompt the LLM would see is effectively the same. Entries expire
+    after ttl seconds, the least recently used go first beyond maxsize, and
+    everything is dropped when the index version changes.
+    """
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, min_similarity=ANSWER_CACHE_MIN_SIM):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.min_similarity = min_similarity
+        self.entries = OrderedDict()   # entry id -> (chunk key, embedding, parsed, created, llm_s)
+        self.by_chunks = {}            # chunk key -> set of entry ids
+        self.version = None
+        self.next_id = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_s = 0.0
+
+    @staticmethod
+    def chunk_key(chunk_ids):
+        return tuple(sorted(chunk_ids))
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.by_chunks.clear()
+            self.version = version
+
+    def _drop(self, entry_id):
+        key = self.entries.pop(entry_id)[0]
+        ids = self.by_chunks[key]
+        ids.discard(entry_id)
+        if not ids:
+            del self.by_chunks[key]
+
+    def lookup(self, q_emb, chunk_ids, version):
+        """Cached parsed answer for this query/context, or None."""
+        now = time.time()
+        with self.lock:
+            self._check_version(version)
+            best, best_sim = None, self.min_similarity
+            for entry_id in list(self.by_chunks.get(self.chunk_key(chunk_ids), ())):
+                _, emb, parsed, created, llm_s = self.entries[entry_id]
+                if now - created > self.ttl:
+                    self._drop(entry_id)
+                    continue
+                sim = float(np.dot(emb, q_emb))
+                if sim >= best_sim:
+                    best, best_sim = entry_id, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best)
+            entry = self.entries[best]
+            self.hits += 1
+            self.saved_s += entry[4]
+            return copy.deepcopy(entry[2])
+
+    def store(self, q_emb, chunk_ids, parsed, llm_s, version):
+        with self.lock:
+            self._check_version(version)
+            key = self.chunk_key(chunk_ids)
+            entry_id = self.next_id
+            self.next_id += 1
+            self.entries[entry_id] = (key, np.array(q_emb, dtype='float32'), copy.deepcopy(parsed), time.time(), llm_s)
+            self.by_chunks.setdefault(key, set()).add(entry_id)
+            while len(self.entries) > self.maxsize:
+                self._drop(next(iter(self.entries)))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "saved_llm_seconds": self.saved_s,
+                "invalidations": self.invalidations}
@@ -1,23 +1,22 @@
 import streamlit as st
 import os
+import re
 import json
 import uuid
-import numpy as np
-from pathlib import Path
-from pdfminer.high_level import extract_text
-from sentence_transformers import SentenceTransformer
-import faiss
 from retriever import Retriever
+import registry
+import snapshots
 import requests
-import tempfile
+from chunk_store import ChunkStore, STORE_DIR
+from ingest import ingest_pdf_folder, EMBED_BATCH_SIZE
 
 # Orchestrator configuration
 ORCHESTRATOR_URL = "http://127.0.0.1:8000/chat"
+ORCHESTRATOR_STREAM_URL = "http://127.0.0.1:8000/chat/stream"
+ORCHESTRATOR_RELOAD_URL = "http://127.0.0.1:8000/admin/reload"
 
 # Configuration
-EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-CHUNK_SIZE = 800
-OVERLAP = 100
+EMBED_MODEL_NAME = registry.EMBED_MODEL_NAME
 INDEX_PATH = "faiss_index.bin"
 META_PATH = "faiss_meta.json"
 RAW_PATH = "faiss_raw.json"
@@ -42,132 +41,59 @@ if 'authenticated' not in st.session_state:
 if 'prev_account_id' not in st.session_state:
     st.session_state.prev_account_id = st.session_state.account_id
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
-    """Chunk text with overlap."""
-    chunks = []
-    start = 0
-    L = len(text)
-    while start < L:
-        end = min(L, start + chunk_size)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
+def index_available():
+    """True when a FAISS index and its chunk metadata (store or legacy JSON) exist."""
+    snap = snapshots.current_dir()
+    legacy = os.path.exists(snap / META_PATH) and os.path.exists(snap / RAW_PATH)
+    return os.path.exists(snap / INDEX_PATH) and (ChunkStore.exists(snap / STORE_DIR) or legacy)
 
-def ingest_pdf_file(pdf_path, existing_metas=None, existing_raw=None, existing_embeddings=None):
-    """Ingest a single PDF file and return embeddings, metas, and raw text."""
-    model = SentenceTransformer(EMBED_MODEL_NAME)
-    embeddings = existing_embeddings if existing_embeddings else []
-    metas = existing_metas if existing_metas else []
-    raw_map = existing_raw if existing_raw else {}
-    
-    print(f'Processing {pdf_path}')
-    text = extract_text(str(pdf_path))
-    chunks = chunk_text(text)
-    
-    for i, chunk in enumerate(chunks):
-        id = str(uuid.uuid4())
-        metas.append({
-            "id": id,
-            "source": Path(pdf_path).name,
-            "chunk_index": i,
-            "text_preview": chunk[:300]
-        })
-        raw_map[id] = chunk
-        emb = model.encode(chunk)
-        embeddings.append(emb)
-    
-    return embeddings, metas, raw_map
-
-def load_or_create_index():
-    """Load existing index or create new one."""
-    if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH) and os.path.exists(RAW_PATH):
-        try:
-            index = faiss.read_index(INDEX_PATH)
-            with open(META_PATH, 'r', encoding='utf8') as f:
-                metas = json.load(f)
-            with open(RAW_PATH, 'r', encoding='utf8') as f:
-                raw_map = json.load(f)
-            return index, metas, raw_map
-        except Exception as e:
-            st.error(f"Error loading existing index: {e}")
-            return None, None, None
-    return None, None, None
-
-def save_index(index, metas, raw_map):
-    """Save FAISS index and metadata."""
-    faiss.write_index(index, INDEX_PATH)
-    with open(META_PATH, 'w', encoding='utf8') as f:
-        json.dump(metas, f, ensure_ascii=False, indent=2)
-    with open(RAW_PATH, 'w', encoding='utf8') as f:
-        json.dump(raw_map, f, ensure_ascii=False, indent=2)
+def source_chunk_counts():
+    """Chunks per source document, read from the chunk store without loading any text."""
+    snap = snapshots.current_dir()
+    if ChunkStore.exists(snap / STORE_DIR):
+        store = ChunkStore(snap / STORE_DIR)
+        counts = store.source_counts()
+        store.close()
+        return counts
+    with open(snap / META_PATH, 'r', encoding='utf8') as f:
+        metas = json.load(f)
+    counts = {}
+    for m in metas:
+        counts[m['source']] = counts.get(m['source'], 0) + 1
+    return counts
 
-def process_uploaded_file(uploaded_file):
-    """Process an uploaded PDF file."""
-    os.makedirs(PDFS_FOLDER, exist_ok=True)
+def process_uploaded_file(uploaded_file, account_id=None):
+    """Process an uploaded PDF file; with account_id it is only searchable for that account."""
+    if account_id and not re.fullmatch(r"[\w-]+", account_id):
+        return False, f"Invalid account id for a document folder: {account_id!r}"
+    # pdfs/<account_id>/ is the account's partition of the index, pdfs/ itself is shared
+    folder = os.path.join(PDFS_FOLDER, account_id) if account_id else PDFS_FOLDER
+    os.makedirs(folder, exist_ok=True)
     
     # Save uploaded file
-    file_path = os.path.join(PDFS_FOLDER, uploaded_file.name)
+    file_path = os.path.join(folder, uploaded_file.name)
     with open(file_path, "wb") as f:
         f.write(uploaded_file.getbuffer())
     
-    # Load existing index if available
-    index, metas, raw_map = load_or_create_index()
-    existing_embeddings = []
+    # Incremental update: only the new/changed PDF is extracted and embedded,
+    # vectors of replaced or deleted files are dropped from the existing index
+    report = ingest_pdf_folder(PDFS_FOLDER, batch_size=EMBED_BATCH_SIZE, incremental=True)
     
-    if index is not None and metas is not None:
-        # Extract existing embeddings from index
-        # Note: FAISS doesn't allow direct extraction, so we'll rebuild
-        # For efficiency, we could store embeddings separately, but for simplicity, we rebuild
-        st.info("Rebuilding index with new document...")
-        existing_embeddings = None  # We'll rebuild from all PDFs
-        metas = []
-        raw_map = {}
-    else:
-        index = None
-        metas = []
-        raw_map = {}
-    
-    # Process all PDFs in the folder (including the new one)
-    model = SentenceTransformer(EMBED_MODEL_NAME)
-    embeddings = []
-    
-    for pdf_file in Path(PDFS_FOLDER).glob("*.pdf"):
-        text = extract_text(str(pdf_file))
-        chunks = chunk_text(text)
-        for i, chunk in enumerate(chunks):
-            id = str(uuid.uuid4())
-            metas.append({
-                "id": id,
-                "source": pdf_file.name,
-                "chunk_index": i,
-                "text_preview": chunk[:300]
-            })
-            raw_map[id] = chunk
-            emb = model.encode(chunk)
-            # Ensure embedding is a numpy array and convert to float32
-            if not isinstance(emb, np.ndarray):
-                emb = np.array(emb)
-            embeddings.append(emb.astype('float32'))
-    
-    if not embeddings:
+    if not report or not report["chunks"]:
         return False, "No chunks found in PDF"
     
-    # Create or update FAISS index
-    X = np.vstack(embeddings).astype('float32')
-    dim = X.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(X)
-    
-    # Save index
-    save_index(index, metas, raw_map)
+    # the orchestrator also polls for new snapshots; this just makes the swap immediate
+    try:
+        requests.post(ORCHESTRATOR_RELOAD_URL, timeout=30)
+    except requests.RequestException:
+        pass
     
-    return True, f"Successfully ingested {len(embeddings)} chunks from {uploaded_file.name}"
+    return True, (f"Successfully ingested {uploaded_file.name}: {report['embedded']} new chunks "
+                  f"({report['chunks']} total) in {report['wall_s']:.1f}s")
 
 def initialize_retrievers():
     """Initialize retriever (for document ingestion only)."""
-    if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH) and os.path.exists(RAW_PATH):
+    if index_available():
         try:
             st.session_state.retriever = Retriever()
             st.session_state.index_loaded = True
@@ -193,10 +119,13 @@ with st.sidebar:
         help="Upload a PDF file to add it to the knowledge base"
     )
     
+    private = st.checkbox(f"Only for account {st.session_state.account_id}", value=False,
+                          help="Private documents are searched only for this account; others are shared by all accounts")
+    
     if uploaded_file is not None:
         if st.button("📥 Ingest Document", type="primary"):
             with st.spinner("Processing document..."):
-                success, message = process_uploaded_file(uploaded_file)
+                success, message = process_uploaded_file(uploaded_file, st.session_state.account_id if private else None)
                 if success:
                     st.success(message)
                     # Reset retrievers to reload index
@@ -210,18 +139,15 @@ with st.sidebar:
     st.header("📊 Index Status")
     
     # Check if index exists
-    if os.path.exists(INDEX_PATH):
+    if index_available():
         try:
-            with open(META_PATH, 'r', encoding='utf8') as f:
-                metas = json.load(f)
-            st.success(f"✅ Index loaded: {len(metas)} chunks")
+            counts = source_chunk_counts()
+            st.success(f"✅ Index loaded: {sum(counts.values())} chunks")
             
             # Show document sources
-            sources = set([m['source'] for m in metas])
-            st.markdown(f"**Documents:** {len(sources)}")
-            for source in sorted(sources):
-                count = sum(1 for m in metas if m['source'] == source)
-                st.markdown(f"  - {source} ({count} chunks)")
+            st.markdown(f"**Documents:** {len(counts)}")
+            for source in sorted(counts):
+                st.markdown(f"  - {source} ({counts[source]} chunks)")
         except Exception as e:
             st.error(f"Error reading index: {e}")
     else:
@@ -251,16 +177,11 @@ if st.session_state.index_loaded and orchestrator_available:
         st.session_state.account_id = st.text_input("Account ID", value=st.session_state.account_id, key="account_id_input")
         st.session_state.authenticated = st.checkbox("Authenticated", value=st.session_state.authenticated, key="auth_checkbox")
     
-    # Detect account change and clear session-specific loaded data so new account is considered
+    # The index is partitioned by account, so switching accounts only changes which documents are searched
     if st.session_state.account_id != st.session_state.prev_account_id:
-        # update previous account marker
         st.session_state.prev_account_id = st.session_state.account_id
-        # clear current in-memory index/retriever/uploaded files so user can ingest for the new account
-        st.session_state.index_loaded = False
-        st.session_state.retriever = None
-        st.session_state.uploaded_files = []
         st.session_state.selected_example = None
-        st.info(f"Account changed to {st.session_state.account_id}. Cleared loaded index and uploaded files for this session. Please ingest documents for the new account.")
+        st.info(f"Account changed to {st.session_state.account_id}. Answers now use shared documents plus this account's own.")
     
     # Query input
     query = st.text_input(
@@ -297,20 +218,34 @@ if st.session_state.index_loaded and orchestrator_available:
                     "authenticated": st.session_state.authenticated
                 }
                 
-                response = requests.post(ORCHESTRATOR_URL, json=payload, timeout=30)
+                # Stream NDJSON events so the answer renders token by token
+                response = requests.post(ORCHESTRATOR_STREAM_URL, json=payload, stream=True, timeout=30)
                 response.raise_for_status()
-                result = response.json()
+                result = {}
+                answer_placeholder = None
+                answer_text = ""
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "intent" and event["intent"] == "faq":
+                        st.success("📚 FAQ Query")
+                        st.markdown("### 📝 Answer")
+                        answer_placeholder = st.empty()
+                    elif event["type"] == "token" and answer_placeholder is not None:
+                        answer_text += event["text"]
+                        answer_placeholder.markdown(answer_text + " ▌")
+                    elif event["type"] == "final":
+                        result = event["result"]
                 
                 intent = result.get("intent", "unknown")
                 
                 # Display intent
                 if intent == "faq":
-                    st.success("📚 FAQ Query")
                     parsed = result.get("response", {})
                     
                     # Display answer
-                    st.markdown("### 📝 Answer")
-                    st.markdown(parsed.get("answer", "No answer generated"))
+                    answer_placeholder.markdown(parsed.get("answer", "No answer generated"))
                     
                     # Display citations
                     st.markdown("### 📚 Citations")
@@ -8,6 +8,7 @@ from pdfminer.high_level import extract_text
 from sentence_transformers import SentenceTransformer
 import faiss
 from retriever import Retriever
+from chunker import chunk_text
 import requests
 import tempfile
 
@@ -16,8 +17,6 @@ ORCHESTRATOR_URL = "http://127.0.0.1:8000/chat"
 
 # Configuration
 EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-CHUNK_SIZE = 800
-OVERLAP = 100
 INDEX_PATH = "faiss_index.bin"
 META_PATH = "faiss_meta.json"
 RAW_PATH = "faiss_raw.json"
@@ -39,19 +38,6 @@ if 'account_id' not in st.session_state:
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = True  # Default for demo
 
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
-    """Chunk text with overlap."""
-    chunks = []
-    start = 0
-    L = len(text)
-    while start < L:
-        end = min(L, start + chunk_size)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
-
 def ingest_pdf_file(pdf_path, existing_metas=None, existing_raw=None, existing_embeddings=None):
     """Ingest a single PDF file and return embeddings, metas, and raw text."""
     model = SentenceTransformer(EMBED_MODEL_NAME)
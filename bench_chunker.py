@@ -0,0 +1,64 @@
+import re, json, argparse, numpy as np
+from pathlib import Path
+from pdfminer.high_level import extract_text
+import chunker, registry
+from ingest import embed_chunks
+
+# The chunker this replaced: fixed 800-character windows with 100 characters of overlap
+def fixed_chunks(text, chunk_size=800, overlap=100):
+    start = 0
+    while start < len(text):
+        chunk = text[start:start+chunk_size].strip()
+        if chunk:
+            yield chunk
+        start += chunk_size - overlap
+
+def squash(text):
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+def faq_pairs(text):
+    """(question, answer) pairs from 'Q. ...? Ans. ...' style FAQ documents."""
+    flat = re.sub(r"\s+", " ", chunker.normalize(text))
+    return [(q.strip(), a.strip()) for q, a in re.findall(r"Q\. (.+?\?) Ans\. (.+?)(?= Q\. |$)", flat)]
+
+def sentences(text, min_words=8):
+    """Sentences of at least min_words words, never spanning a paragraph break."""
+    out = []
+    for para in chunker.normalize(text).split("\n\n"):
+        flat = re.sub(r"\s+", " ", para)
+        out += [s for s in re.split(r"(?<=[.?!])\s+(?=[A-Z])", flat) if len(s.split()) >= min_words]
+    return out
+
+def evaluate(model, docs, chunk_fn, queries, k=4):
+    chunks = [c for text in docs.values() for c in chunk_fn(text)]
+    X = embed_chunks(model, chunks)
+    Q = embed_chunks(model, [q for q, _ in queries])
+    squashed = [squash(c) for c in chunks]
+    ranks = []
+    for (q, answer), scores in zip(queries, Q @ X.T):
+        needle = squash(answer)[:80]
+        top = np.argsort(-scores)[:k]
+        ranks.append(next((r + 1 for r, i in enumerate(top) if needle in squashed[i]), None))
+    whole = [s for text in docs.values() for s in sentences(text)]
+    intact = sum(any(squash(s) in c for c in squashed) for s in whole) / max(len(whole), 1)
+    return {"chunks": len(chunks), "mean_chars": float(np.mean([len(c) for c in chunks])),
+            "recall@1": float(np.mean([r == 1 for r in ranks])), f"recall@{k}": float(np.mean([r is not None for r in ranks])),
+            "mrr": float(np.mean([1 / r if r else 0 for r in ranks])), "sentences_intact": intact}
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Retrieval quality of the structure-aware chunker vs fixed windows")
+    parser.add_argument('pdf_folder', nargs='?', default='pdfs')
+    parser.add_argument('--queries', help="JSONL of {\"query\", \"answer\"}; default: Q./Ans. pairs found in the PDFs")
+    parser.add_argument('--k', type=int, default=4)
+    args = parser.parse_args()
+    docs = {p.name: extract_text(str(p)) for p in sorted(Path(args.pdf_folder).glob("*.pdf"))}
+    if args.queries:
+        with open(args.queries,'r',encoding='utf8') as f:
+            queries = [(row["query"], row["answer"]) for row in (json.loads(line) for line in f if line.strip())]
+    else:
+        queries = [pair for text in docs.values() for pair in faq_pairs(text)]
+    print(f"{len(docs)} PDFs, {len(queries)} queries")
+    model = registry.get_model(remote=False)
+    for name, fn in [("fixed", lambda t: fixed_chunks(t)), ("structure", chunker.chunk_text)]:
+        row = evaluate(model, docs, fn, queries, args.k)
+        print(f"{name:10} " + ' '.join(f"{key}={val:.3f}" if isinstance(val, float) else f"{key}={val}" for key, val in row.items()))
@@ -0,0 +1,73 @@
+import time, argparse, numpy as np
+from pathlib import Path
+import registry, snapshots, chunker
+from chunk_store import ChunkStore, STORE_DIR
+from embedding_backends import BACKENDS
+from ingest import embed_chunks
+from router import ROUTE_EXAMPLES
+
+# (mean, min) cosine to the torch embedding of the same text a backend must reach
+PARITY_COSINE = {"onnx": (0.9999, 0.999), "onnx-int8": (0.99, 0.95)}
+
+def corpus(pdf_folder="pdfs"):
+    """Chunk texts of the current index, or of pdf_folder when nothing is indexed, plus short FAQ-style queries."""
+    store_dir = snapshots.current_dir() / STORE_DIR
+    if ChunkStore.exists(store_dir):
+        store = ChunkStore(store_dir)
+        texts = [store.text(row) for row in range(len(store))]
+    else:
+        from pdfminer.high_level import extract_text
+        texts = [c for p in sorted(Path(pdf_folder).glob("*.pdf")) for c in chunker.chunk_text(extract_text(str(p)))]
+    return texts, [q for examples in ROUTE_EXAMPLES.values() for q in examples]
+
+def parity(backends, texts, queries, k=4):
+    """Cosine agreement with torch per text, and overlap of each query's top-k chunks."""
+    ref = registry.get_model(remote=False, backend="torch")
+    X_ref, Q_ref = embed_chunks(ref, texts), embed_chunks(ref, queries)
+    top_ref = np.argsort(-(Q_ref @ X_ref.T), axis=1)[:, :k]
+    ok = True
+    for backend in backends:
+        if backend == "torch":
+            continue
+        model = registry.get_model(remote=False, backend=backend)
+        X, Q = embed_chunks(model, texts), embed_chunks(model, queries)
+        cos = np.concatenate([(X * X_ref).sum(1), (Q * Q_ref).sum(1)])
+        top = np.argsort(-(Q @ X.T), axis=1)[:, :k]
+        overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(top, top_ref)])
+        mean_min, min_min = PARITY_COSINE[backend]
+        passed = cos.mean() >= mean_min and cos.min() >= min_min
+        ok &= passed
+        print(f"parity {backend:10} cosine mean={cos.mean():.5f} min={cos.min():.5f} p1={np.percentile(cos, 1):.5f} "
+              f"top{k} overlap={overlap:.3f} {'ok' if passed else 'FAIL'} (need mean>={mean_min} min>={min_min})")
+    return ok
+
+def bench(backend, texts, queries, batch_size=64, rounds=5):
+    t0 = time.perf_counter()
+    model = registry.get_model(remote=False, backend=backend)
+    model.encode(queries[:1])
+    load_s = time.perf_counter() - t0
+    lat = []
+    for _ in range(rounds):
+        for q in queries:
+            t = time.perf_counter()
+            model.encode(q)
+            lat.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    embed_chunks(model, texts, batch_size)
+    ingest_s = time.perf_counter() - t
+    print(f"bench  {backend:10} load {load_s:6.2f}s | query p50 {np.percentile(lat, 50)*1000:6.2f}ms "
+          f"p95 {np.percentile(lat, 95)*1000:6.2f}ms | ingest {len(texts)/ingest_s:8.1f} chunks/s (batch {batch_size})")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Parity with torch and latency/throughput of each embedding backend")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument('--pdfs', default='pdfs', help="used when there is no index yet")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--skip-parity', action='store_true')
+    args = parser.parse_args()
+    texts, queries = corpus(args.pdfs)
+    print(f"{len(texts)} chunks, {len(queries)} queries")
+    for backend in args.backends:
+        bench(backend, texts, queries, args.batch_size)
+    ok = True if args.skip_parity else parity(args.backends, texts, queries)
+    raise SystemExit(0 if ok else 1)
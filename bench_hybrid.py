@@ -0,0 +1,48 @@
+import re, time, argparse, numpy as np
+from pathlib import Path
+from pdfminer.high_level import extract_text
+import bm25
+from retriever import Retriever
+from bench_chunker import faq_pairs, squash
+
+def exact_term_queries(ret, limit=200):
+    """(query, term) pairs asking about a code-like term (digits, '_' or '-') found in the indexed chunks."""
+    df = {t: int(ret.bm25.ptr[i+1] - ret.bm25.ptr[i]) for t, i in ret.bm25.term_id.items()}
+    queries, seen = [], set()
+    for row in range(len(ret.store)):
+        terms = [t for t in set(bm25.tokenize(ret.store.text(row))) if re.search(r"\d|[_-]", t) and len(t) > 3]
+        if not terms:
+            continue
+        term = min(terms, key=lambda t: (df[t], t))
+        if term not in seen:
+            seen.add(term)
+            queries.append((f"what does {term} refer to", term))
+    return queries[:limit]
+
+def evaluate(ret, queries, hit, k):
+    ranks, t0 = [], time.perf_counter()
+    for q, target in queries:
+        metas = ret.retrieve(q, top_k=k)
+        ranks.append(next((r + 1 for r, m in enumerate(metas) if hit(target, m['text'])), None))
+    ms = (time.perf_counter() - t0) / max(len(queries), 1) * 1000
+    return (f"recall@1={np.mean([r == 1 for r in ranks]):.3f} recall@{k}={np.mean([r is not None for r in ranks]):.3f} "
+            f"mrr={np.mean([1 / r if r else 0 for r in ranks]):.3f} {ms:.2f}ms/query")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Hit rate of vector-only vs hybrid BM25+vector retrieval on the current index")
+    parser.add_argument('pdf_folder', nargs='?', default='pdfs')
+    parser.add_argument('--k', type=int, default=4)
+    args = parser.parse_args()
+    hybrid = Retriever()
+    if hybrid.bm25 is None:
+        raise SystemExit("The current snapshot has no BM25 index; run ingest.py first")
+    vector = Retriever(hybrid=False, query_cache=hybrid.query_cache)
+    faq = [pair for p in sorted(Path(args.pdf_folder).glob("*.pdf")) for pair in faq_pairs(extract_text(str(p)))]
+    exact = exact_term_queries(hybrid)
+    suites = [("faq", faq, lambda answer, text: squash(answer)[:80] in squash(text)),
+              ("exact-term", exact, lambda term, text: term in bm25.tokenize(text))]
+    hybrid.embed_many([q for _, queries, _ in suites for q, _ in queries])  # time retrieval, not the model
+    for name, queries, hit in suites:
+        print(f"{name} ({len(queries)} queries)")
+        for label, ret in [("vector", vector), ("hybrid", hybrid)]:
+            print(f"  {label:7} {evaluate(ret, queries, hit, args.k)}")
@@ -0,0 +1,100 @@
+import re, time, random, argparse
+from redaction import redact_pii, luhn_valid
+
+# The redactor this replaced: one full regex pass per pattern, lazy card quantifier
+LEGACY_PATTERNS = [
+    (re.compile(r"\b(?:\d[ -]*?){13,19}\b"), '<CARD_MASK>'),
+    (re.compile(r"\b\d{3}-\d{2}-\d{4}\b"), '<SSN_MASK>'),
+    (re.compile(r"\b\d{10}\b"), '<PHONE_MASK>'),
+    (re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"), '<EMAIL_MASK>'),
+]
+
+def legacy_redact_pii(text):
+    replacements={}
+    for pat,mask in LEGACY_PATTERNS:
+        def repl(m):
+            key = f"{mask}_{len(replacements)+1}"
+            replacements[key]=m.group(0)
+            return key
+        text = pat.sub(repl, text)
+    return text, replacements
+
+def card(rng, valid=True, sep=''):
+    digits = [rng.randrange(10) for _ in range(15)]
+    for check in range(10):
+        if luhn_valid(''.join(map(str, digits + [check]))) == valid:
+            break
+    s = ''.join(map(str, digits + [check]))
+    return sep.join(s[i:i+4] for i in range(0, 16, 4))
+
+def message(rng):
+    parts = ["my card", card(rng, sep=rng.choice(['', ' ', '-'])), "was charged twice, call me on",
+             ''.join(str(rng.randrange(10)) for _ in range(10)), "or mail", f"user{rng.randrange(999)}@example.com",
+             "ssn", f"{rng.randrange(100,999)}-{rng.randrange(10,99)}-{rng.randrange(1000,9999)}"]
+    return ' '.join(parts)
+
+PATHOLOGICAL = {
+    "digits":           lambda n: '7' * n,
+    "spaced digits":    lambda n: '1 ' * (n // 2),
+    "dashed digits":    lambda n: '12-' * (n // 3),
+    "statement":        lambda n: ("2024-05-01  4111 1111 1111 1112  INR 1,234.00  REF 98765432109876\n" * n)[:n],
+    "dotted local part": lambda n: 'a.' * (n // 2),
+    "at signs":         lambda n: 'a@' * (n // 2),
+    "long domain":      lambda n: 'a@' + 'b' * (n - 3) + '_',
+}
+
+def timed(fn, text, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def check_linear(sizes=(10_000, 100_000), max_ratio=25.0):
+    """Time per input for each pathological family must grow ~linearly with its length."""
+    ok = True
+    for name, make in PATHOLOGICAL.items():
+        small, large = (timed(redact_pii, make(n)) for n in sizes)
+        ratio = large / max(small, 1e-6)
+        ok &= ratio <= max_ratio
+        legacy = timed(legacy_redact_pii, make(sizes[0]), 1)
+        print(f"{name:18} {sizes[0]:>7} chars {small*1000:8.2f}ms (legacy {legacy*1000:8.2f}ms)  "
+              f"{sizes[1]:>7} chars {large*1000:8.2f}ms  x{ratio:5.1f} {'ok' if ratio <= max_ratio else 'SUPERLINEAR'}")
+    return ok
+
+def fuzz(iterations=20_000, seed=0):
+    """Random inputs: must not raise, and restoring the masks must give back the input."""
+    rng = random.Random(seed)
+    alphabet = "0123456789" * 4 + "  --..@_%+abcxyz\n"
+    failures = 0
+    for _ in range(iterations):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randrange(1, 120)))
+        redacted, replacements = redact_pii(text)
+        restored = redacted
+        for key in sorted(replacements, key=len, reverse=True):
+            restored = restored.replace(key, replacements[key], 1)
+        if restored != text:
+            failures += 1
+            if failures <= 5:
+                print(f"round trip failed: {text!r} -> {redacted!r}")
+    print(f"fuzz: {iterations} random inputs, {failures} failures")
+    return failures == 0
+
+def compare(n=2_000, seed=0):
+    """Realistic messages: same masks and keys as the legacy redactor, and the speed of each."""
+    rng = random.Random(seed)
+    texts = [message(rng) for _ in range(n)]
+    same = sum(redact_pii(t) == legacy_redact_pii(t) for t in texts)
+    new_s = sum(timed(redact_pii, t, 1) for t in texts)
+    old_s = sum(timed(legacy_redact_pii, t, 1) for t in texts)
+    print(f"messages: {same}/{n} identical to legacy output | legacy {old_s/n*1e6:.1f}us/msg, "
+          f"single pass {new_s/n*1e6:.1f}us/msg")
+    return same == n
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Benchmark and fuzz the single-pass PII redactor")
+    parser.add_argument('--iterations', type=int, default=20_000)
+    args = parser.parse_args()
+    results = [compare(), check_linear(), fuzz(args.iterations)]
+    raise SystemExit(0 if all(results) else 1)
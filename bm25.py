@@ -0,0 +1,105 @@
+import re, numpy as np
+import tracing
+
+BM25_PATH = "bm25.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+# a lexical-only hit needs at least this BM25 score (a term in nearly every chunk scores ~0)
+BM25_MIN_SCORE = 1.0
+# reciprocal rank fusion constant: a hit at rank r contributes 1 / (RRF_K + r)
+RRF_K = 60
+
+# words, numbers and codes; "Account_ID", "XXXX-XXXX-1234", "85,000" and "2.50" stay one token
+_TOKEN = re.compile(r"[^\W_]+(?:[_\-/.,][^\W_]+)*")
+_PART = re.compile(r"[^\W_]+")
+STOPWORDS = frozenset("""a an and are as at be by can do does for from has have how i if in is it its me my no
+not of on or our so that the their then there these this to was we what when where which who why will with
+you your""".split())
+
+def tokenize(text):
+    """Lower-cased terms of text; a code also yields its parts so "1234" finds "XXXX-XXXX-1234"."""
+    terms = []
+    for m in _TOKEN.finditer(text.lower()):
+        token = m.group()
+        parts = _PART.findall(token)
+        for t in ([token] if len(parts) > 1 else []) + parts:
+            if t in STOPWORDS:
+                continue
+            # plural folding, so "charges" matches "charge"
+            terms.append(t[:-1] if len(t) > 3 and t[-1] == 's' and t[-2] != 's' and t.isalpha() else t)
+    return terms
+
+class BM25Index:
+    """Okapi BM25 over chunk texts, stored as CSR postings.
+
+    terms[t] owns postings ptr[t]:ptr[t+1]; each posting is a row (int32,
+    into vids) and a term frequency (uint16). Per-posting weights are
+    computed on load, so k1/b can change without a rebuild.
+    """
+    def __init__(self, terms, ptr, rows, tf, doc_len, vids, k1=BM25_K1, b=BM25_B):
+        self.term_id = {t: i for i, t in enumerate(terms)}
+        self.ptr, self.rows, self.tf, self.doc_len, self.vids = ptr, rows, tf, doc_len, vids
+        n = len(vids)
+        df = np.diff(ptr)
+        self.idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype('float32')
+        norm = k1 * (1 - b + b * doc_len / max(float(doc_len.mean()) if n else 1.0, 1e-9))
+        tf = tf.astype('float32')
+        self.weight = (tf * (k1 + 1) / (tf + norm[rows])).astype('float32')
+
+    def __len__(self):
+        return len(self.vids)
+
+    @classmethod
+    def build(cls, vids, texts, **kwargs):
+        postings = {}   # term -> {row: tf}
+        doc_len = np.zeros(len(texts), dtype='int32')
+        for row, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_len[row] = len(terms)
+            for t in terms:
+                counts = postings.setdefault(t, {})
+                counts[row] = counts.get(row, 0) + 1
+        terms = sorted(postings)
+        ptr = np.zeros(len(terms) + 1, dtype='int64')
+        ptr[1:] = np.cumsum([len(postings[t]) for t in terms])
+        rows = np.fromiter((r for t in terms for r in postings[t]), dtype='int32', count=int(ptr[-1]))
+        tf = np.fromiter((min(c, 65535) for t in terms for c in postings[t].values()), dtype='uint16', count=int(ptr[-1]))
+        return cls(terms, ptr, rows, tf, doc_len, np.asarray(vids, dtype='int64'), **kwargs)
+
+    def save(self, path):
+        terms = sorted(self.term_id, key=self.term_id.get)
+        np.savez_compressed(path, terms=np.array([t.encode('utf8') for t in terms], dtype=bytes),
+                            ptr=self.ptr, rows=self.rows, tf=self.tf, doc_len=self.doc_len, vids=self.vids)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with np.load(path) as data:
+            terms = [t.decode('utf8') for t in data["terms"]]
+            return cls(terms, data["ptr"], data["rows"], data["tf"], data["doc_len"], data["vids"], **kwargs)
+
+    @tracing.traced("bm25_search")
+    def search(self, query, top_k=20, min_score=BM25_MIN_SCORE, mask=None):
+        """[(vid, score)] of the best top_k chunks for query, best first; mask (bool per row) limits the rows."""
+        ids = [self.term_id[t] for t in set(tokenize(query)) if t in self.term_id]
+        if not ids or not len(self.vids):
+            return []
+        scores = np.zeros(len(self.vids), dtype='float32')
+        for t in ids:
+            lo, hi = self.ptr[t], self.ptr[t+1]
+            scores[self.rows[lo:hi]] += self.idf[t] * self.weight[lo:hi]
+        top = np.flatnonzero(scores >= min_score if mask is None else (scores >= min_score) & mask)
+        if len(top) > top_k:
+            top = top[np.argpartition(-scores[top], top_k)[:top_k]]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self.vids[r]), float(scores[r])) for r in top]
+
+    def search_many(self, queries, top_k=20, min_score=BM25_MIN_SCORE, masks=None):
+        return [self.search(q, top_k, min_score, mask) for q, mask in zip(queries, masks or [None] * len(queries))]
+
+def rrf(rankings, k=RRF_K):
+    """Reciprocal rank fusion of several best-first id lists; returns {id: score}."""
+    fused = {}
+    for ranking in rankings:
+        for rank, id in enumerate(ranking, 1):
+            fused[id] = fused.get(id, 0.0) + 1.0 / (k + rank)
+    return fused
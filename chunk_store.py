@@ -0,0 +1,159 @@
+import os, json, mmap, shutil, argparse, numpy as np
+from pathlib import Path
+
+STORE_DIR = "chunk_store"
+META_PATH = "faiss_meta.json"
+RAW_PATH = "faiss_raw.json"
+PREVIEW_CHARS = 300
+
+class ChunkStore:
+    """Columnar, memory-mapped store of chunk text and metadata.
+
+    Layout of the store directory:
+      text.bin        all chunk texts, UTF-8, back to back
+      offsets.npy     int64[n+1] byte offsets into text.bin
+      vid.npy         int64[n] vector ids (ascending, as used by the FAISS IDMap)
+      id.npy          S36[n] chunk uuids
+      source.npy      int32[n] index into sources.json
+      chunk_index.npy int32[n] chunk number within its source
+      sources.json    list of source file names
+      partition.npy   int32[n] index into partitions.json
+      partitions.json list of partition names ("" = shared by every account)
+
+    Columns are opened with mmap so lookups by row need no parsing and the
+    pages are shared between every process that opens the same store.
+    """
+    COLUMNS = ("offsets", "vid", "id", "source", "chunk_index")
+
+    def __init__(self, path=STORE_DIR):
+        self.path = Path(path)
+        for col in self.COLUMNS:
+            setattr(self, col, np.load(self.path / f"{col}.npy", mmap_mode='r'))
+        with open(self.path / "sources.json",'r',encoding='utf8') as f:
+            self.sources = json.load(f)
+        # stores written before partitions existed hold only shared chunks
+        if (self.path / "partition.npy").exists():
+            self.partition = np.load(self.path / "partition.npy", mmap_mode='r')
+            with open(self.path / "partitions.json",'r',encoding='utf8') as f:
+                self.partitions = json.load(f)
+        else:
+            self.partition = np.zeros(len(self.vid), dtype='int32')
+            self.partitions = [""]
+        self._blob = None
+        if self.offsets[-1] > 0:
+            with open(self.path / "text.bin",'rb') as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def exists(path=STORE_DIR):
+        return (Path(path) / "offsets.npy").exists()
+
+    def __len__(self):
+        return len(self.vid)
+
+    def text(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row+1])
+        return self._blob[start:end].decode('utf8') if end > start else ''
+
+    def row_of(self, vid):
+        """Row holding vector id vid, or None."""
+        row = int(np.searchsorted(self.vid, vid))
+        return row if row < len(self.vid) and self.vid[row] == vid else None
+
+    def meta(self, row, with_text=True):
+        text = self.text(row)
+        meta = {"id": self.id[row].decode('ascii'), "vid": int(self.vid[row]),
+                "source": self.sources[self.source[row]], "chunk_index": int(self.chunk_index[row]),
+                "partition": self.partitions[self.partition[row]], "text_preview": text[:PREVIEW_CHARS]}
+        if with_text:
+            meta['text'] = text
+        return meta
+
+    def vids_in(self, partitions):
+        """Sorted vector ids of the chunks in any of partitions."""
+        codes = [i for i, name in enumerate(self.partitions) if name in partitions]
+        return np.asarray(self.vid[np.isin(self.partition, codes)], dtype='int64')
+
+    def source_counts(self):
+        counts = np.bincount(self.source, minlength=len(self.sources))
+        return {name: int(c) for name, c in zip(self.sources, counts) if c}
+
+    def to_records(self):
+        """Materialise (metas, raw_map) in the in-memory form used by ingest."""
+        metas, raw_map = [], {}
+        for row in range(len(self)):
+            meta = self.meta(row)
+            raw_map[meta['id']] = meta.pop('text')
+            metas.append(meta)
+        return metas, raw_map
+
+    def close(self):
+        if self._blob is not None:
+            self._blob.close()
+            self._blob = None
+
+    @staticmethod
+    def write(metas, raw_map, path=STORE_DIR):
+        """Write metas/raw_map as a store at path, replacing any existing one."""
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        rows = sorted(range(len(metas)), key=lambda i: metas[i].get('vid', i))
+        sources, source_code = [], {}
+        partitions, partition_code = [], {}
+        offsets = np.zeros(len(rows)+1, dtype='int64')
+        cols = {"vid": np.empty(len(rows), dtype='int64'), "id": np.empty(len(rows), dtype='S36'),
+                "source": np.empty(len(rows), dtype='int32'), "chunk_index": np.empty(len(rows), dtype='int32'),
+                "partition": np.empty(len(rows), dtype='int32')}
+        with open(tmp / "text.bin",'wb') as f:
+            for out, i in enumerate(rows):
+                m = metas[i]
+                data = raw_map.get(m['id'], m.get('text_preview','')).encode('utf8')
+                f.write(data)
+                offsets[out+1] = offsets[out] + len(data)
+                if m['source'] not in source_code:
+                    source_code[m['source']] = len(sources)
+                    sources.append(m['source'])
+                cols["vid"][out] = m.get('vid', i)
+                cols["id"][out] = m['id'].encode('ascii')
+                cols["source"][out] = source_code[m['source']]
+                cols["chunk_index"][out] = m['chunk_index']
+                part = m.get('partition', '')
+                if part not in partition_code:
+                    partition_code[part] = len(partitions)
+                    partitions.append(part)
+                cols["partition"][out] = partition_code[part]
+        np.save(tmp / "offsets.npy", offsets)
+        for col, arr in cols.items():
+            np.save(tmp / f"{col}.npy", arr)
+        with open(tmp / "sources.json",'w',encoding='utf8') as f:
+            json.dump(sources,f,ensure_ascii=False)
+        with open(tmp / "partitions.json",'w',encoding='utf8') as f:
+            json.dump(partitions,f,ensure_ascii=False)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+def migrate(meta_path=META_PATH, raw_path=RAW_PATH, out=STORE_DIR):
+    """Convert the legacy faiss_meta.json / faiss_raw.json pair into a chunk store.
+
+    Metas without a "vid" (indexes built before incremental ingest) get their
+    row position, which is what a plain IndexFlatL2 returns as a label.
+    """
+    with open(meta_path,'r',encoding='utf8') as f:
+        metas = json.load(f)
+    with open(raw_path,'r',encoding='utf8') as f:
+        raw_map = json.load(f)
+    ChunkStore.write(metas, raw_map, out)
+    print(f"Migrated {len(metas)} chunks from {meta_path} + {raw_path} into {out}/")
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Chunk store tools")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    m = sub.add_parser('migrate', help="convert faiss_meta.json/faiss_raw.json into a chunk store")
+    m.add_argument('--meta', default=META_PATH)
+    m.add_argument('--raw', default=RAW_PATH)
+    m.add_argument('--out', default=STORE_DIR)
+    args = parser.parse_args()
+    if args.cmd == 'migrate':
+        migrate(args.meta, args.raw, args.out)
@@ -0,0 +1,147 @@
+import re, functools
+import registry, embedding_backends
+
+# chunks are measured in the embedding model's own word pieces: all-MiniLM-L6-v2 reads at most 256
+# (with [CLS] and [SEP]) and silently drops the rest
+TOKENIZER_NAME = f"sentence-transformers/{registry.EMBED_MODEL_NAME}"
+CHUNK_TOKENS = 230
+# trailing sentences of a chunk repeated at the start of the next, up to this many tokens
+CHUNK_OVERLAP_TOKENS = 45
+# pdfminer wraps narrow table cells mid-word ("Accou\nnt_ID"); lines up to this long may be rejoined
+MAX_CELL_CHARS = 12
+# everything that changes chunk boundaries; part of the extraction cache key
+SETTINGS = {"chunker": "structure-v2", "tokenizer": TOKENIZER_NAME, "chunk_tokens": CHUNK_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+            "max_cell_chars": MAX_CELL_CHARS}
+
+# a line that is one short cell fragment, and its wrapped remainder on the next line
+# (or after a blank line, if the remainder is a short lower-case word: "Person\n\nal")
+_CELL = r"(?m)(^\S{0,%d}" % (MAX_CELL_CHARS - 1)
+_CELL_WRAP = re.compile(_CELL + r"[^\s_-])\n(?:(?=[a-z0-9_)])|\n(?=[a-z]\S{0,%d}$))" % (MAX_CELL_CHARS - 1))
+_CELL_JOIN = re.compile(_CELL + r"[_-])\n(?=\S)")  # "Card_\nLimit", "XXXX-\nXXXX-\n1234"
+_HYPHEN_WRAP = re.compile(r"(?<=\w-)\n(?=[a-z])")
+# pdfminer sometimes emits a blank line inside a sentence ("2.50% per\n\nannum.")
+_SOFT_BREAK = re.compile(r"(?<=[a-z,])\n\n(?=[a-z])")
+# a paragraph break, or a line of a table (three or more cells separated by 2+ spaces, tabs or |)
+_BLOCK = re.compile(r"[^\n]+(?:\n(?!\n)[^\n]+)*")
+_TABLE_ROW = re.compile(r"^\S.*?(?: {2,}|\t| \| )\S.*?(?: {2,}|\t| \| )\S")
+_BULLET = r"(?:[•\uf075\-–*]|o(?=\s)|\d{1,2}[.)](?=\s))"
+# a sentence end, or a line break before a list item; other line breaks are pdfminer's wrapping
+_SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+(?=[\"“(\[]?[A-Z]|%s)|\n(?=%s)" % (_BULLET, _BULLET))
+# "Q.", "Ans.", "Rs.", "No.", "2." end no sentence
+_ABBREVIATION = re.compile(r"(?:^|\s)(?:[A-Z][a-z]{0,2}|\d{1,2})\.$")
+
+@functools.lru_cache(maxsize=1)
+def tokenizer():
+    """The embedding model's tokenizer, from models/ when it was exported there, else the Hub."""
+    from transformers import AutoTokenizer
+    local = embedding_backends.model_path(registry.EMBED_MODEL_NAME)
+    return AutoTokenizer.from_pretrained(local if local != registry.EMBED_MODEL_NAME else TOKENIZER_NAME)
+
+def count_tokens(text):
+    """Word pieces the embedding model sees for text, not counting [CLS]/[SEP]."""
+    return len(tokenizer().tokenize(text))
+
+def _unjustify(m):
+    # justified prose has every gap widened; table cell gaps sit between single-spaced words
+    line = m.group()
+    gaps = re.findall(r"(?<=\S)[^\S\n]+(?=\S)", line)
+    if len(gaps) >= 6 and all(len(g) > 1 for g in gaps):
+        return re.sub(r"(?<=\S)[^\S\n]+(?=\S)", " ", line)
+    return line
+
+def normalize(text):
+    """pdfminer text with page breaks as paragraph breaks, wrapped words and cells rejoined, and tidy spaces."""
+    text = text.replace('\x0c', '\n\n').replace('\r', '')
+    # a wrapped cell ends without the trailing space pdfminer leaves on a wrapped line, so join before stripping
+    text = _CELL_WRAP.sub(r"\1", text)
+    text = _CELL_JOIN.sub(r"\1", text)
+    text = re.sub(r"[^\S\n]+\n", "\n", text)
+    text = _HYPHEN_WRAP.sub("", text)
+    text = _SOFT_BREAK.sub(" ", text)
+    text = re.sub(r"(?m)^.+$", _unjustify, text)
+    text = re.sub(r"(?<=\S)[^\S\n]{2,}(?=\S)", "  ", text)  # cell gaps stay two spaces, runs are collapsed
+    text = re.sub(r"(?m)^[^\S\n]+", "", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+def iter_units(text):
+    """(start, end, is_break_after) spans of the smallest pieces a chunk may be cut between.
+
+    Table rows are single units so they are never split; other paragraphs are
+    split into sentences (and line items). is_break_after marks paragraph ends.
+    """
+    for block in _BLOCK.finditer(text):
+        lines = block.group().split('\n')
+        if sum(bool(_TABLE_ROW.match(line)) for line in lines) * 2 >= len(lines) > 1 or _TABLE_ROW.match(lines[0]):
+            pos = block.start()
+            for line in lines:
+                yield pos, pos + len(line), False
+                pos += len(line) + 1
+        else:
+            pos = block.start()
+            for m in _SENTENCE_END.finditer(block.group()):
+                if m.group()[0] != '\n' and _ABBREVIATION.search(block.group(), max(0, m.start() - 5), m.start()):
+                    continue
+                if m.start() > pos - block.start():
+                    yield pos, block.start() + m.start(), False
+                pos = block.start() + m.end()
+            if pos < block.end():
+                yield pos, block.end(), False
+        yield block.end(), block.end(), True
+
+def _split_long(text, start, end, max_tokens):
+    """Word-boundary pieces of a single unit that is over budget on its own."""
+    piece = start
+    while piece < end:
+        cut = min(end, piece + max_tokens * 4)
+        while count_tokens(text[piece:cut]) > max_tokens and cut - piece > 1:
+            cut = piece + (cut - piece) * 3 // 4
+        if cut < end:
+            space = text.rfind(' ', piece + 1, cut)
+            cut = space if space > piece else cut
+        yield piece, cut
+        piece = cut + 1 if cut < end and text[cut] == ' ' else cut
+
+def chunk_spans(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Generator of (start, end) chunk offsets into normalized text.
+
+    Units (sentences, table rows) are packed greedily up to max_tokens,
+    preferring to end a chunk at a paragraph break once it is half full; the
+    last units of a chunk, up to overlap_tokens, open the next one.
+    """
+    units, tokens = [], 0   # [(start, end, tokens)] of the chunk being built
+    def emit():
+        return units[0][0], units[-1][1]
+    for start, end, para_end in iter_units(text):
+        if para_end:
+            if units and tokens >= max_tokens // 2:
+                yield emit()
+                units, tokens = [], 0
+            continue
+        n = count_tokens(text[start:end])
+        if n > max_tokens:
+            if units:
+                yield emit()
+            for piece in _split_long(text, start, end, max_tokens):
+                yield piece
+            units, tokens = [], 0
+            continue
+        if units and tokens + n > max_tokens:
+            yield emit()
+            carry, carried = [], 0
+            for u in reversed(units):
+                if carried + u[2] > overlap_tokens or carried + u[2] + n > max_tokens:
+                    break
+                carry.insert(0, u)
+                carried += u[2]
+            units, tokens = carry, carried
+        units.append((start, end, n))
+        tokens += n
+    if units:
+        yield emit()
+
+def chunk_text(text, max_tokens=CHUNK_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """Generator of chunk strings for raw extracted text."""
+    text = normalize(text)
+    for start, end in chunk_spans(text, max_tokens, overlap_tokens):
+        yield text[start:end]
@@ -0,0 +1,102 @@
+import re
+
+# tokens of retrieved text allowed into RAG_PROMPT's contexts block
+CONTEXT_TOKEN_BUDGET = 600
+# a chunk cut down to fewer tokens than this is left out instead
+MIN_PASSAGE_TOKENS = 40
+# longest/shortest suffix-prefix overlap looked for when joining neighbouring chunks
+MAX_OVERLAP_CHARS = 400
+MIN_OVERLAP_CHARS = 16
+TOKENIZER_MODEL = "gpt-4.1-mini"
+
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("o200k_base")
+except ImportError:  # ~4 characters per token for English text
+    _encoding = None
+
+def count_tokens(text):
+    return len(_encoding.encode(text)) if _encoding else (len(text) + 3) // 4
+
+def truncate_tokens(text, max_tokens):
+    """Longest prefix of text within max_tokens, cut back to a sentence or word boundary."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = _encoding.decode(_encoding.encode(text)[:max_tokens]) if _encoding else text[:max_tokens * 4]
+    sentence = max(cut.rfind('. '), cut.rfind('.\n'), cut.rfind('\n'))
+    if sentence > len(cut) // 2:
+        return cut[:sentence + 1]
+    space = cut.rfind(' ')
+    return cut[:space] if space > 0 else cut
+
+def normalize_whitespace(text):
+    text = re.sub(r"[ \t\f\v]+", " ", text)
+    return re.sub(r" ?\n[ \n]*", lambda m: "\n\n" if m.group(0).count("\n") > 1 else "\n", text).strip()
+
+def overlap(a, b):
+    """Length of the longest suffix of a that is also a prefix of b (0 below MIN_OVERLAP_CHARS)."""
+    for k in range(min(len(a), len(b), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:k]):
+            return k
+    return 0
+
+def relevance(m):
+    """Cross-encoder score when the chunk was re-ranked, else its retrieval score."""
+    return m.get('rerank_score', m.get('score', 0.0))
+
+def merge_adjacent(metas):
+    """Join retrieved chunks that are neighbours in the same source into one passage.
+
+    The overlap ingest gives consecutive chunks is kept once, the passage
+    scores as its best chunk (by relevance()), and exact duplicate texts are dropped.
+    """
+    by_source, seen = {}, set()
+    for m in metas:
+        if m['text'] in seen:
+            continue
+        seen.add(m['text'])
+        by_source.setdefault(m['source'], []).append(m)
+    passages = []
+    for source, chunks in by_source.items():
+        chunks.sort(key=lambda m: m['chunk_index'])
+        run = [chunks[0]]
+        for m in chunks[1:] + [None]:
+            if m is not None and m['chunk_index'] == run[-1]['chunk_index'] + 1:
+                run.append(m)
+                continue
+            text = run[0]['text']
+            for nxt in run[1:]:
+                k = overlap(text, nxt['text'])
+                text += nxt['text'][k:] if k else "\n" + nxt['text']
+            passages.append({"source": source, "chunk_index": run[0]['chunk_index'],
+                             "chunk_indices": [c['chunk_index'] for c in run],
+                             "score": max(relevance(c) for c in run), "text": text})
+            run = [m]
+    return passages
+
+def pack(metas, budget=CONTEXT_TOKEN_BUDGET):
+    """Passages to put in the prompt: merged, whitespace-normalised, most relevant first, within budget tokens."""
+    packed, used = [], 0
+    for p in sorted(merge_adjacent(metas), key=lambda p: -p['score']):
+        header = count_tokens(format_header(p)) + 2
+        room = budget - used - header
+        if room < MIN_PASSAGE_TOKENS:
+            continue
+        text = truncate_tokens(normalize_whitespace(p['text']), room)
+        tokens = count_tokens(text)
+        if tokens < MIN_PASSAGE_TOKENS and tokens < count_tokens(p['text']):
+            continue
+        packed.append(dict(p, text=text, tokens=tokens))
+        used += header + tokens
+    return packed
+
+def format_header(p):
+    indices = p['chunk_indices']
+    chunks = f"chunk {indices[0]}" if len(indices) == 1 else f"chunks {indices[0]}-{indices[-1]}"
+    return f"Source: {p['source']} ({chunks})"
+
+def format_contexts(passages):
+    return '\n\n'.join(f"{format_header(p)}\n{p['text']}" for p in passages)
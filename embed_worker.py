@@ -0,0 +1,24 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from pydantic import BaseModel
+import registry
+
+# One process holds the embedding model for every orchestrator worker:
+#   uvicorn embed_worker:app --port 8002
+#   EMBED_WORKER_URL=http://127.0.0.1:8002 uvicorn server_orchestrator:app --workers 4 --port 8000
+
+@asynccontextmanager
+async def lifespan(app):
+    registry.get_model(remote=False).encode(["warm up"])
+    yield
+
+app = FastAPI(lifespan=lifespan)
+
+class EmbedRequest(BaseModel):
+    texts: list[str]
+    batch_size: int = 64
+
+@app.post('/embed')
+def embed(req: EmbedRequest):
+    model = registry.get_model(remote=False)
+    return registry.encode_embeddings(model.encode(req.texts, batch_size=req.batch_size, convert_to_numpy=True))
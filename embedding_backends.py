@@ -0,0 +1,53 @@
+import os, platform, argparse
+from pathlib import Path
+
+# torch: the original fp32 PyTorch model. onnx: the same weights on ONNX Runtime.
+# onnx-int8: ONNX Runtime with dynamically int8-quantized weights (CPU only, fastest).
+EMBED_BACKEND = os.environ.get("EMBED_BACKEND", "torch")
+BACKENDS = ("torch", "onnx", "onnx-int8")
+# `python embedding_backends.py export` writes here; a model found here is loaded instead of the Hub copy
+MODELS_DIR = "models"
+# dynamic quantization preset per CPU family; the Hub repo for all-MiniLM-L6-v2 ships these files
+INT8_CONFIG = "arm64" if platform.machine().lower() in ("arm64", "aarch64") else "avx2"
+INT8_FILES = {"arm64": "model_qint8_arm64.onnx", "avx2": "model_quint8_avx2.onnx"}
+INT8_FILE = os.environ.get("EMBED_ONNX_FILE", INT8_FILES[INT8_CONFIG])
+
+def model_path(name):
+    local = Path(MODELS_DIR) / name
+    return str(local) if local.exists() else name
+
+def load_model(name, backend=EMBED_BACKEND):
+    """A SentenceTransformer for name on backend; all three have the same encode() and outputs.
+
+    ONNX backends need `pip install sentence-transformers[onnx]` (optimum +
+    onnxruntime) and run on the CPU execution provider, no GPU required.
+    """
+    from sentence_transformers import SentenceTransformer
+    if backend == "torch":
+        return SentenceTransformer(model_path(name))
+    if backend == "onnx":
+        return SentenceTransformer(model_path(name), backend="onnx", model_kwargs={"provider": "CPUExecutionProvider"})
+    if backend == "onnx-int8":
+        return SentenceTransformer(model_path(name), backend="onnx",
+                                   model_kwargs={"provider": "CPUExecutionProvider", "file_name": INT8_FILE})
+    raise ValueError(f"unknown embedding backend {backend!r}; expected one of {BACKENDS}")
+
+def export(name, out=None, config=INT8_CONFIG):
+    """Save name with its fp32 and int8 ONNX exports under MODELS_DIR, for boxes that cannot reach the Hub."""
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+    out = out or str(Path(MODELS_DIR) / name)
+    SentenceTransformer(name).save_pretrained(out)
+    model = SentenceTransformer(name, backend="onnx", model_kwargs={"provider": "CPUExecutionProvider"})
+    model.save_pretrained(out)
+    export_dynamic_quantized_onnx_model(model, config, out, file_suffix=INT8_FILES[config][len("model_"):-len(".onnx")])
+    print(f"Exported {name} to {out}/ (onnx/model.onnx, onnx/{INT8_FILES[config]})")
+
+if __name__=='__main__':
+    import registry
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX (fp32 + int8)")
+    parser.add_argument('cmd', choices=['export'])
+    parser.add_argument('--model', default=registry.EMBED_MODEL_NAME)
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--config', choices=sorted(INT8_FILES), default=INT8_CONFIG)
+    args = parser.parse_args()
+    export(args.model, args.out, args.config)
@@ -0,0 +1,63 @@
+import os, json, time, hashlib
+from pathlib import Path
+
+CACHE_DIR = ".extract_cache"
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+class ExtractCache:
+    """On-disk cache of extracted PDF text and chunk boundaries.
+
+    Entries are keyed by the PDF's SHA-256 plus the extractor/chunker settings,
+    so changing the chunker settings or upgrading pdfminer never serves stale chunks.
+    Reads refresh the entry's mtime and writes evict the least recently used
+    entries once the directory exceeds max_bytes.
+    """
+    def __init__(self, settings, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, sha256):
+        return self.dir / f"{sha256}-{self.settings_digest}.json"
+
+    def get(self, sha256):
+        """Return (text, spans) for a cached PDF, or None."""
+        path = self._path(sha256)
+        try:
+            with open(path,'r',encoding='utf8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["text"], [tuple(span) for span in entry["spans"]]
+
+    def put(self, sha256, text, spans):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(sha256)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp,'w',encoding='utf8') as f:
+            json.dump({"text": text, "spans": spans, "created": time.time()}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for path in self.dir.glob("*.json"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
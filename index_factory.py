@@ -0,0 +1,231 @@
+import os, json, time, argparse, numpy as np
+import faiss
+import snapshots
+
+INDEX_PATH = "faiss_index.bin"
+PARAMS_PATH = "faiss_index.json"
+EMB_PATH = "faiss_emb.npy"
+
+# Embeddings are L2-normalised, so inner product is cosine similarity
+DEFAULT_METRIC = "ip"
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+# Build-time settings per index kind; nprobe/efSearch are search-time and are re-applied on load
+DEFAULT_PARAMS = {
+    "flat":  {},
+    "ivf":   {"nlist": 1024, "nprobe": 16},
+    "ivfpq": {"nlist": 1024, "m": 48, "nbits": 8, "nprobe": 16},
+    "hnsw":  {"M": 32, "efConstruction": 200, "efSearch": 64},
+}
+SEARCH_PARAMS = ("nprobe", "efSearch", "refine")
+
+# How vectors are stored inside flat/ivf/hnsw indexes ("storage" param, fp32 when absent):
+# fp16 halves memory with no measurable recall loss, sq8 is 4x smaller, pq 8-byte-per-
+# subvector codes are ~32x smaller. "refine": k re-scores refine*k candidates exactly
+# against the float32 embeddings, which stay on disk and are only memory-mapped.
+STORAGE = ("fp32", "fp16", "sq8", "pq")
+SQ_TYPES = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+PQ_M = 48  # sub-quantizers for storage=pq; must divide the embedding dim (384 / 48 = 8)
+
+def make_params(kind="flat", overrides=None):
+    if kind not in DEFAULT_PARAMS:
+        raise ValueError(f"unknown index kind {kind!r}; expected one of {sorted(DEFAULT_PARAMS)}")
+    params = {"kind": kind, "metric": DEFAULT_METRIC, **DEFAULT_PARAMS[kind]}
+    params.update(overrides or {})
+    return params
+
+def build_index(X, ids, params=None):
+    """Build and train an index of params['kind'] over X, labelled with ids.
+
+    IVF lists are capped so each centroid gets ~39 training points, and PQ
+    codebooks shrink to what the corpus can train; the effective values are
+    written back into params so they are persisted with the index.
+    """
+    params = params if params is not None else make_params()
+    X = np.ascontiguousarray(X, dtype='float32')
+    ids = np.asarray(ids, dtype='int64')
+    n, d = X.shape
+    kind = params["kind"]
+    metric = METRICS[params.get("metric", "l2")]
+    storage = params.get("storage", "fp32")
+    if storage not in STORAGE:
+        raise ValueError(f"unknown storage {storage!r}; expected one of {STORAGE}")
+    if storage == "pq" or kind == "ivfpq":
+        params["m"] = params.get("m", PQ_M)
+        params["nbits"] = max(1, min(params.get("nbits", 8), int(np.log2(max(n, 2)))))
+    if kind == "flat":
+        if storage == "pq":
+            codec = faiss.IndexPQ(d, params["m"], params["nbits"], metric)
+        elif storage in SQ_TYPES:
+            codec = faiss.IndexScalarQuantizer(d, SQ_TYPES[storage], metric)
+        else:
+            codec = faiss.IndexFlat(d, metric)
+        index = faiss.IndexIDMap2(codec)
+    elif kind in ("ivf", "ivfpq"):
+        params["nlist"] = max(1, min(params["nlist"], n // 39))
+        quantizer = faiss.IndexFlat(d, metric)
+        if kind == "ivfpq" or storage == "pq":
+            index = faiss.IndexIVFPQ(quantizer, d, params["nlist"], params["m"], params["nbits"], metric)
+        elif storage in SQ_TYPES:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, params["nlist"], SQ_TYPES[storage], metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, d, params["nlist"], metric)
+    elif kind == "hnsw":
+        if storage == "pq":
+            hnsw = faiss.IndexHNSWPQ(d, params["m"], params["M"], params["nbits"], metric)
+        elif storage in SQ_TYPES:
+            hnsw = faiss.IndexHNSWSQ(d, SQ_TYPES[storage], params["M"], metric)
+        else:
+            hnsw = faiss.IndexHNSWFlat(d, params["M"], metric)
+        hnsw.hnsw.efConstruction = params["efConstruction"]
+        index = faiss.IndexIDMap2(hnsw)
+    else:
+        raise ValueError(f"unknown index kind {kind!r}")
+    if not index.is_trained:
+        index.train(X)
+    index.add_with_ids(X, ids)
+    apply_search_params(index, params)
+    return index
+
+def apply_search_params(index, params):
+    ps = faiss.ParameterSpace()
+    for name in SEARCH_PARAMS:
+        if name in params and name in DEFAULT_PARAMS[params["kind"]]:
+            ps.set_index_parameter(index, name, params[name])
+
+def refine(Q, I, exact, vids=None, k=4, metric_type=faiss.METRIC_INNER_PRODUCT):
+    """Re-score candidate labels I (n, k') exactly and keep the best k: returns (D, I) like index.search.
+
+    exact holds the float32 unit vectors (typically a memmap of EMB_PATH);
+    a label's row is its position in the sorted vids, or the label itself
+    when vids is None. Only the candidate rows are read.
+    """
+    valid = I >= 0
+    rows = np.where(valid, np.searchsorted(vids, I) if vids is not None else I, 0)
+    needed = np.unique(rows[valid])
+    V = np.asarray(exact[needed], dtype='float32')
+    S = np.einsum('nkd,nd->nk', V[np.searchsorted(needed, rows)], Q) if len(needed) else np.zeros(I.shape, 'float32')
+    S[~valid] = -np.inf
+    order = np.argsort(-S, axis=1, kind='stable')[:, :k]
+    D, I = np.take_along_axis(S, order, 1), np.take_along_axis(I, order, 1)
+    # back in the index's own units, so similarity() applies unchanged
+    return (D if metric_type == faiss.METRIC_INNER_PRODUCT else 2.0 - 2.0 * D), I
+
+def supports_selector(params):
+    """Whether searches can be restricted with an IDSelector (faiss' IndexPQ does not take one)."""
+    return not (params["kind"] == "flat" and params.get("storage") == "pq")
+
+def search_params(params, sel):
+    """SearchParameters limiting a search to the ids in sel, with the index's own nprobe/efSearch."""
+    if params["kind"] in ("ivf", "ivfpq"):
+        return faiss.SearchParametersIVF(sel=sel, nprobe=params.get("nprobe", 1))
+    if params["kind"] == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=params.get("efSearch", 16))
+    return faiss.SearchParameters(sel=sel)
+
+def memory_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+def needs_retrain(old, new):
+    """True when build-time settings differ; search-time ones are simply re-applied."""
+    build = lambda p: {k: v for k, v in p.items() if k not in SEARCH_PARAMS}
+    return build(old) != build(new)
+
+def supports_remove(params):
+    """HNSW graphs cannot drop vectors; those indexes are rebuilt from stored embeddings instead."""
+    return params["kind"] != "hnsw"
+
+def save_params(params, path=PARAMS_PATH):
+    with open(path,'w',encoding='utf8') as f:
+        json.dump(params,f,indent=2)
+
+def load_params(path=PARAMS_PATH):
+    """Persisted params, or those of a plain L2 flat index for indexes built before they existed."""
+    if not os.path.exists(path):
+        return make_params("flat", {"metric": "l2"})
+    with open(path,'r',encoding='utf8') as f:
+        params = json.load(f)
+    params.setdefault("metric", "l2")
+    return params
+
+def similarity(distances, metric_type):
+    """Cosine similarity from FAISS scores over unit vectors (|a-b|^2 = 2 - 2cos for L2 indexes)."""
+    if metric_type == faiss.METRIC_L2:
+        return 1.0 - distances / 2.0
+    return distances
+
+def load_index(path=INDEX_PATH, params_path=PARAMS_PATH):
+    index = faiss.read_index(str(path))
+    params = load_params(params_path)
+    apply_search_params(index, params)
+    return index, params
+
+def parse_overrides(pairs):
+    """['nprobe=32', 'metric=ip'] -> {'nprobe': 32, 'metric': 'ip'}"""
+    out = {}
+    for pair in pairs or []:
+        key, _, value = pair.partition('=')
+        out[key] = int(value) if value.lstrip('-').isdigit() else value
+    return out
+
+def bench(X, k=4, n_queries=200, configs=None, seed=0):
+    """Recall@k, per-query latency and memory of each config against exact flat search.
+
+    Queries are stored embeddings with a little Gaussian noise, so the report
+    runs on the real corpus distribution without needing the encoder.
+    Memory is the serialized index scaled to a million chunks; with refine
+    the float32 vectors are read from X, as the retriever reads them from disk.
+    """
+    rng = np.random.default_rng(seed)
+    X = np.ascontiguousarray(X, dtype='float32')
+    ids = np.arange(len(X), dtype='int64')
+    Q = X[rng.choice(len(X), size=min(n_queries, len(X)), replace=False)]
+    Q = (Q + rng.normal(0, 0.02, Q.shape)).astype('float32')
+    configs = configs or [
+        ("flat", {}),
+        *[("flat", {"storage": st}) for st in ("fp16", "sq8", "pq")],
+        *[("flat", {"storage": st, "refine": 4}) for st in ("sq8", "pq")],
+        *[("ivf", {"nprobe": p}) for p in (1, 4, 16, 64)],
+        ("ivf", {"storage": "sq8", "nprobe": 16}),
+        *[("ivfpq", {"nprobe": p}) for p in (4, 16, 64)],
+        ("ivfpq", {"nprobe": 16, "refine": 4}),
+        *[("hnsw", {"efSearch": e}) for e in (16, 32, 64, 128)],
+        ("hnsw", {"storage": "sq8", "efSearch": 64}),
+    ]
+    _, truth = build_index(X, ids).search(Q, k)
+    rows = []
+    for kind, overrides in configs:
+        params = make_params(kind, overrides)
+        t = time.perf_counter()
+        index = build_index(X, ids, params)
+        build_s = time.perf_counter() - t
+        fetch = k * params.get("refine", 1)
+        lat = []
+        found = np.empty_like(truth)
+        for i in range(len(Q)):
+            t = time.perf_counter()
+            D, I = index.search(Q[i:i+1], fetch)
+            if fetch > k:
+                D, I = refine(Q[i:i+1], I, X, None, k, index.metric_type)
+            found[i:i+1] = I
+            lat.append(time.perf_counter() - t)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)])
+        lat = np.array(lat) * 1000
+        rows.append({"params": params, "recall": float(recall), "build_s": build_s,
+                     "mb_per_1m": memory_bytes(index) / len(X) * 1e6 / 2**20,
+                     "p50_ms": float(np.percentile(lat, 50)), "p99_ms": float(np.percentile(lat, 99))})
+    return rows
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Recall@k, latency and memory of index/storage settings against exact flat search")
+    parser.add_argument('--emb', default=str(snapshots.current_dir() / EMB_PATH), help="embeddings saved by ingest.py")
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    X = np.load(args.emb)
+    print(f"{len(X)} vectors, dim {X.shape[1]}, recall@{args.k} vs flat, index memory per million chunks")
+    for row in bench(X, args.k, args.queries):
+        p = row["params"]
+        shown = ' '.join(f"{key}={val}" for key, val in p.items() if key != 'kind')
+        print(f"{p['kind']:6} {shown:55} recall={row['recall']:.3f} mem={row['mb_per_1m']:8.1f}MB/1M "
+              f"p50={row['p50_ms']:.3f}ms p99={row['p99_ms']:.3f}ms build={row['build_s']:.2f}s")
@@ -1,61 +1,372 @@
-import os, json, uuid, numpy as np
+import os, json, time, uuid, queue, hashlib, argparse, threading, numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from pdfminer.high_level import extract_text
-from sentence_transformers import SentenceTransformer
+from pdfminer.pdfpage import PDFPage
+import pdfminer
 import faiss
+from extract_cache import ExtractCache
+import chunker
+from chunk_store import ChunkStore, STORE_DIR
+import registry
+import index_factory
+import snapshots
+import bm25
 
-EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
-CHUNK_SIZE = 800
-OVERLAP = 100
-INDEX_PATH = "faiss_index.bin"
-META_PATH = "faiss_meta.json"
-RAW_PATH = "faiss_raw.json"
-
-def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=OVERLAP):
-    chunks=[]
-    start=0
-    L=len(text)
-    while start < L:
-        end=min(L, start+chunk_size)
-        chunk=text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        start += chunk_size - overlap
-    return chunks
-
-def ingest_pdf_folder(pdf_folder="pdfs"):
-    model = SentenceTransformer(EMBED_MODEL_NAME)
-    embeddings=[]
-    metas=[]
-    raw_map={}
-    for pdf_file in Path(pdf_folder).glob("*.pdf"):
-        print('Processing', pdf_file)
-        text = extract_text(str(pdf_file))
-        chunks = chunk_text(text)
-        for i, chunk in enumerate(chunks):
+EMBED_MODEL_NAME = registry.EMBED_MODEL_NAME
+EMBED_BATCH_SIZE = 64
+SORT_WINDOW = 4  # batches buffered from the pipeline before length-sorting
+INGEST_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+QUEUE_DEPTH = 512
+PAGES_PER_TASK = 16
+INDEX_PATH = index_factory.INDEX_PATH
+PARAMS_PATH = index_factory.PARAMS_PATH
+EMB_PATH = index_factory.EMB_PATH
+FILES_PATH = "faiss_files.json"
+
+# Anything that changes extracted text or chunk boundaries must be part of the cache key
+EXTRACT_CACHE = ExtractCache({"extractor": f"pdfminer.six {pdfminer.__version__}", **chunker.SETTINGS})
+
+def embed_chunks(model, texts, batch_size=EMBED_BATCH_SIZE):
+    """Encode texts in length-sorted batches into one contiguous, L2-normalised float32 matrix.
+
+    Sorting by length keeps similar-sized chunks in the same batch so little
+    compute is spent on padding; rows are written back in the original order.
+    """
+    order = np.argsort([len(t) for t in texts], kind='stable')
+    X = None
+    for start in range(0, len(order), batch_size):
+        idx = order[start:start+batch_size]
+        emb = model.encode([texts[i] for i in idx], batch_size=len(idx), convert_to_numpy=True)
+        if X is None:
+            X = np.empty((len(texts), emb.shape[1]), dtype='float32')
+        X[idx] = emb
+    if X is not None:
+        faiss.normalize_L2(X)
+    return X
+
+def count_pages(path):
+    with open(path,'rb') as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+def extract_pages(path, pages=None):
+    return extract_text(str(path), page_numbers=pages)
+
+def iter_extracted(pdf_files, workers=INGEST_WORKERS, pages_per_task=PAGES_PER_TASK):
+    """Yield (pdf_file, text) per PDF as soon as it is fully extracted.
+
+    With workers > 1 extraction runs in a process pool; PDFs longer than
+    pages_per_task are split into page ranges that are extracted in parallel
+    and stitched back together in page order.
+    """
+    pdf_files = [Path(p) for p in pdf_files]
+    if workers <= 1:
+        for pdf_file in pdf_files:
+            yield pdf_file, extract_pages(pdf_file)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            pending, parts = {}, {}
+            for pdf_file in pdf_files:
+                n = count_pages(pdf_file)
+                ranges = [None] if n <= pages_per_task else \
+                    [list(range(s, min(n, s + pages_per_task))) for s in range(0, n, pages_per_task)]
+                parts[pdf_file] = [None] * len(ranges)
+                for k, pages in enumerate(ranges):
+                    pending[pool.submit(extract_pages, str(pdf_file), pages)] = (pdf_file, k)
+            for fut in as_completed(pending):
+                pdf_file, k = pending.pop(fut)
+                parts[pdf_file][k] = fut.result()
+                if all(part is not None for part in parts[pdf_file]):
+                    yield pdf_file, ''.join(parts.pop(pdf_file))
+        finally:
+            # closed early (the consumer failed): drop queued page ranges instead of extracting them
+            pool.shutdown(cancel_futures=True)
+
+def source_name(pdf_file, root=None):
+    """How a PDF is named in the index: its file name, prefixed by its partition folder if it has one."""
+    pdf_file = Path(pdf_file)
+    return pdf_file.relative_to(root).as_posix() if root else pdf_file.name
+
+def partition_of(source):
+    """pdfs/<partition>/x.pdf belongs to that partition (e.g. an account id); pdfs/x.pdf is shared ("")."""
+    return source.rpartition('/')[0]
+
+class _Stopped(Exception):
+    pass
+
+def _produce_chunks(pdf_files, q, workers, hashes, cache, names, stop):
+    def put(item):
+        # stop is set when the consumer gives up, so a full queue cannot block this thread forever
+        while not stop.is_set():
+            try:
+                return q.put(item, timeout=0.1)
+            except queue.Full:
+                pass
+        raise _Stopped
+    def emit(pdf_file, text, spans):
+        for i, (start, end) in enumerate(spans):
+            put((names[pdf_file], i, text[start:end]))
+    extracted = None
+    try:
+        to_extract = []
+        for pdf_file in pdf_files:
+            hit = cache.get(hashes[names[pdf_file]]) if cache else None
+            if hit is None:
+                to_extract.append(pdf_file)
+            else:
+                print('Cached', pdf_file)
+                emit(pdf_file, *hit)
+        extracted = iter_extracted(to_extract, workers)
+        for pdf_file, text in extracted:
+            print('Processing', pdf_file)
+            # chunks go to the embedder as the chunker yields them; the cache stores the normalized text
+            text, spans = chunker.normalize(text), []
+            for i, (start, end) in enumerate(chunker.chunk_spans(text)):
+                spans.append((start, end))
+                put((names[pdf_file], i, text[start:end]))
+            if cache:
+                cache.put(hashes[names[pdf_file]], text, spans)
+        put(None)
+    except _Stopped:
+        pass
+    except BaseException as e:
+        try:
+            put(e)
+        except _Stopped:
+            pass
+    finally:
+        if extracted is not None:
+            extracted.close()  # shuts the extraction pool down
+
+def run_pipeline(pdf_files, model=None, batch_size=EMBED_BATCH_SIZE, workers=INGEST_WORKERS, queue_depth=QUEUE_DEPTH,
+                 hashes=None, cache=EXTRACT_CACHE, root=None):
+    """Extract, chunk and embed pdf_files with parsing overlapped with embedding.
+
+    A producer thread serves unchanged PDFs from the extraction cache, drives
+    the extraction pool for the rest and pushes chunks into a bounded queue
+    (queue_depth) so parsing never runs far ahead of the embedding stage,
+    which drains it in length-sorted batches. If embedding fails, the
+    producer and its extraction pool are stopped before the error is raised.
+    Sources are named relative to root (see source_name) and each chunk's
+    meta records its partition.
+    Returns (X, metas, raw_map, embed_s); X is None when no chunks were found.
+    """
+    pdf_files = [Path(p) for p in pdf_files]
+    names = {p: source_name(p, root) for p in pdf_files}
+    if cache and hashes is None:
+        hashes = {names[p]: file_sha256(p) for p in pdf_files}
+    q = queue.Queue(maxsize=queue_depth)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce_chunks, args=(pdf_files, q, workers, hashes, cache, names, stop),
+                                name="ingest-producer", daemon=True)
+    producer.start()
+    metas, raw_map, blocks, window = [], {}, [], []
+    embed_s = 0.0
+    def flush():
+        nonlocal model, embed_s
+        if not window:
+            return
+        t = time.perf_counter()
+        model = model or registry.get_model(EMBED_MODEL_NAME)
+        blocks.append(embed_chunks(model, [chunk for _, _, chunk in window], batch_size))
+        embed_s += time.perf_counter() - t
+        for source, i, chunk in window:
             id = str(uuid.uuid4())
-            metas.append({ "id": id, "source": pdf_file.name, "chunk_index": i, "text_preview": chunk[:300]})
+            metas.append({ "id": id, "source": source, "chunk_index": i, "partition": partition_of(source),
+                           "text_preview": chunk[:300]})
             raw_map[id] = chunk
-            emb = model.encode(chunk)
-            # Ensure embedding is a numpy array and convert to float32
-            if not isinstance(emb, np.ndarray):
-                emb = np.array(emb)
-            embeddings.append(emb.astype('float32'))
-    if not embeddings:
+        window.clear()
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            window.append(item)
+            if len(window) >= batch_size * SORT_WINDOW:
+                flush()
+        flush()
+    finally:
+        # when embedding fails the producer stops at its next put and takes the extraction pool down with it
+        stop.set()
+        producer.join()
+    X = np.concatenate(blocks) if blocks else None
+    return X, metas, raw_map, embed_s
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def save_index(index, metas, raw_map, embeddings=None, files=None, params=None):
+    """Write everything into a new snapshot and publish it atomically; returns the snapshot dir."""
+    snap = snapshots.new_snapshot()
+    # embedding rows follow the chunk store's vid order, so a vid's store row is also its embedding row
+    order = np.argsort([m['vid'] for m in metas], kind='stable')
+    metas = [metas[i] for i in order]
+    if embeddings is not None:
+        embeddings = embeddings[order]
+    faiss.write_index(index, str(snap / INDEX_PATH))
+    index_factory.save_params(params or index_factory.make_params(), snap / PARAMS_PATH)
+    ChunkStore.write(metas, raw_map, snap / STORE_DIR)
+    # rebuilt from all chunk texts; tokenizing is cheap next to embedding
+    bm25.BM25Index.build([m['vid'] for m in metas], [raw_map[m['id']] for m in metas]).save(snap / bm25.BM25_PATH)
+    if embeddings is not None:
+        np.save(snap / EMB_PATH, embeddings)
+    if files is not None:
+        with open(snap / FILES_PATH,'w',encoding='utf8') as f:
+            json.dump(files,f,indent=2)
+    snapshots.publish(snap)
+    return snap
+
+def current_params(snap=None):
+    """Index params of the published index, or None when nothing has been built yet."""
+    path = Path(snap or snapshots.current_dir()) / PARAMS_PATH
+    return index_factory.load_params(path) if path.exists() else None
+
+def load_state(snap=None):
+    """Load the persisted index, metadata, per-chunk embeddings and file fingerprints.
+
+    Reads the current snapshot unless snap is given. Returns None when any
+    piece is missing (e.g. an index built before incremental ingest), in
+    which case the caller rebuilds from scratch.
+    """
+    snap = Path(snap or snapshots.current_dir())
+    paths = [snap / INDEX_PATH, snap / EMB_PATH, snap / FILES_PATH]
+    if not all(os.path.exists(p) for p in paths) or not ChunkStore.exists(snap / STORE_DIR):
+        return None
+    store = ChunkStore(snap / STORE_DIR)
+    metas, raw_map = store.to_records()
+    store.close()
+    with open(snap / FILES_PATH,'r',encoding='utf8') as f:
+        files = json.load(f)
+    embeddings = np.load(snap / EMB_PATH)
+    if len(embeddings) != len(metas):
+        return None
+    index, params = index_factory.load_index(snap / INDEX_PATH, snap / PARAMS_PATH)
+    return {"index": index, "params": params, "metas": metas, "raw": raw_map,
+            "embeddings": embeddings, "files": files}
+
+def format_report(report):
+    return (f"{report['chunks']} chunks ({report['embedded']} embedded) | files +{report['added']} "
+            f"-{report['removed']} ={report['unchanged']} (cached {report['cached']}) | pipeline {report['pipeline_s']:.2f}s "
+            f"({report['chunks_per_sec']:.1f} chunks/s, index={report['index']}, workers={report['workers']}, batch={report['batch_size']}) | "
+            f"embed {report['embed_s']:.2f}s | total {report['wall_s']:.2f}s")
+
+def ingest_pdf_folder(pdf_folder="pdfs", batch_size=EMBED_BATCH_SIZE, model=None, incremental=False,
+                      workers=INGEST_WORKERS, queue_depth=QUEUE_DEPTH, cache=EXTRACT_CACHE,
+                      index_kind=None, index_params=None):
+    """Bring the index in line with the PDFs in pdf_folder; returns a throughput report dict.
+
+    With incremental=True only new or changed files (by SHA-256) are extracted and
+    embedded; vectors of deleted or replaced files are removed from the index.
+    Otherwise everything is rebuilt, reusing cached extractions of unchanged
+    PDFs unless cache is None. index_kind/index_params pick the FAISS index
+    type (see index_factory); by default the previously built type is kept,
+    and changing it re-trains from the stored embeddings without re-embedding.
+    batch_size=1 reproduces the old one-forward-pass-per-chunk behaviour.
+    PDFs in a subfolder (pdf_folder/<account_id>/) are only retrievable for
+    that partition; the partition is stored with each chunk in the chunk store.
+    """
+    t0 = time.perf_counter()
+    # shared PDFs at the top level, partition-private ones one folder down (pdfs/<account_id>/*.pdf)
+    pdf_files = sorted(Path(pdf_folder).glob("*.pdf")) + sorted(Path(pdf_folder).glob("*/*.pdf"))
+    hashes = {source_name(p, pdf_folder): file_sha256(p) for p in pdf_files}
+    state = load_state() if incremental else None
+    if state is not None and (state["params"] or {}).get("chunker") != chunker.SETTINGS:
+        # chunks from another chunker cannot be mixed in; re-chunk everything into the same kind of index
+        print('Chunker settings changed - rebuilding all chunks')
+        state = {**state, "index": None, "metas": [], "raw": {}, "embeddings": None, "files": {}}
+    if state is None:
+        state = {"index": None, "params": None, "metas": [], "raw": {}, "embeddings": None, "files": {}}
+    metas, raw_map, files = state["metas"], state["raw"], state["files"]
+    # a full rebuild keeps the current index type and storage too; only index_kind/index_params change them
+    params = dict(state["params"] or current_params() or {})
+    if not params or (index_kind and index_kind != params["kind"]):
+        params = index_factory.make_params(index_kind or params.get("kind", "flat"))
+    params.update(index_params or {})
+    params["chunker"] = chunker.SETTINGS
+
+    stale = {name for name, digest in files.items() if hashes.get(name) != digest}
+    todo = [p for p in pdf_files if files.get(source_name(p, pdf_folder)) != hashes[source_name(p, pdf_folder)]]
+    keep = [i for i, m in enumerate(metas) if m['source'] not in stale]
+    removed_vids = [m['vid'] for m in metas if m['source'] in stale]
+    next_vid = max((m['vid'] for m in metas), default=-1) + 1
+
+    t1 = time.perf_counter()
+    hits_before = cache.hits if cache else 0
+    X_new, new_metas, new_raw, embed_s = run_pipeline(todo, model, batch_size, workers, queue_depth, hashes, cache, pdf_folder)
+    t2 = time.perf_counter()
+    if not new_metas and not metas:
         print('No PDF chunks found - ensure pdfs/ has PDF files.')
-        return
-    # Stack embeddings into a 2D numpy array
-    X = np.vstack(embeddings).astype('float32')
-    dim = X.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(X)
-    faiss.write_index(index, INDEX_PATH)
-    with open(META_PATH,'w',encoding='utf8') as f:
-        json.dump(metas,f,ensure_ascii=False,indent=2)
-    with open(RAW_PATH,'w',encoding='utf8') as f:
-        json.dump(raw_map,f,ensure_ascii=False,indent=2)
-    print('Ingestion complete:', len(metas),'chunks saved.')
+        return None
+    for m in new_metas:
+        m['vid'] = next_vid
+        next_vid += 1
+    new_ids = [m['vid'] for m in new_metas]
+
+    index, embeddings = state["index"], state["embeddings"]
+    if embeddings is None:
+        embeddings = X_new
+    else:
+        parts = [embeddings[keep]] + ([X_new] if X_new is not None else [])
+        embeddings = np.concatenate(parts).astype('float32')
+    if (index is None or index_factory.needs_retrain(state["params"], params)
+            or (removed_vids and not index_factory.supports_remove(params))):
+        index = index_factory.build_index(embeddings, [metas[i]['vid'] for i in keep] + new_ids, params)
+    else:
+        if removed_vids:
+            index.remove_ids(np.asarray(removed_vids, dtype='int64'))
+        if X_new is not None:
+            index.add_with_ids(X_new, np.asarray(new_ids, dtype='int64'))
+        index_factory.apply_search_params(index, params)
+    for m in metas:
+        if m['source'] in stale:
+            raw_map.pop(m['id'], None)
+    metas = [metas[i] for i in keep] + new_metas
+    raw_map.update(new_raw)
+    files = {name: digest for name, digest in files.items() if name not in stale}
+    files.update({source_name(p, pdf_folder): hashes[source_name(p, pdf_folder)] for p in todo})
+    if (todo or stale or state["index"] is None or params != state["params"]
+            or not (snapshots.current_dir() / bm25.BM25_PATH).exists()):
+        save_index(index, metas, raw_map, embeddings, files, params)  # nothing to publish (and reload) otherwise
+
+    wall = time.perf_counter() - t0
+    report = {"chunks": len(metas), "embedded": len(new_metas), "added": len(todo), "unchanged": len(pdf_files)-len(todo),
+              "removed": len(stale - set(hashes)), "index": params["kind"], "cached": (cache.hits if cache else 0) - hits_before, "batch_size": batch_size, "workers": workers,
+              "pipeline_s": t2-t1, "embed_s": embed_s, "wall_s": wall, "chunks_per_sec": len(new_metas)/max(t2-t1, 1e-9)}
+    print('Ingestion complete:', format_report(report))
+    return report
 
 if __name__=='__main__':
-    os.makedirs('pdfs', exist_ok=True)
-    ingest_pdf_folder('pdfs')
+    parser = argparse.ArgumentParser(description="Ingest PDFs into the FAISS index")
+    parser.add_argument('pdf_folder', nargs='?', default='pdfs')
+    parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE,
+                        help="chunks per encode call (1 = legacy per-chunk path)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only embed new/changed PDFs and drop vectors of deleted ones")
+    parser.add_argument('--workers', type=int, default=INGEST_WORKERS,
+                        help="PDF extraction processes (1 = extract in-process)")
+    parser.add_argument('--queue-depth', type=int, default=QUEUE_DEPTH,
+                        help="max chunks buffered between extraction and embedding")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="re-run pdfminer even for PDFs in the extraction cache")
+    parser.add_argument('--index', choices=sorted(index_factory.DEFAULT_PARAMS), default=None,
+                        help="FAISS index type (default: keep the existing one, else flat)")
+    parser.add_argument('--index-param', action='append', metavar='KEY=VALUE',
+                        help="index setting such as nlist=256, nprobe=32, M=16, efSearch=128 or refine=4")
+    parser.add_argument('--storage', choices=index_factory.STORAGE, default=None,
+                        help="vector storage inside the index: fp32, fp16, sq8 (scalar-quantized) or pq (default: keep)")
+    args = parser.parse_args()
+    index_params = index_factory.parse_overrides(args.index_param)
+    if args.storage:
+        index_params["storage"] = args.storage
+    os.makedirs(args.pdf_folder, exist_ok=True)
+    ingest_pdf_folder(args.pdf_folder, batch_size=args.batch_size, incremental=args.incremental,
+                      workers=args.workers, queue_depth=args.queue_depth,
+                      cache=None if args.no_cache else EXTRACT_CACHE, index_kind=args.index,
+                      index_params=index_params)
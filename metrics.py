@@ -0,0 +1,61 @@
+import bisect, threading
+
+# seconds; spans the ~1ms cache hits up to multi-second LLM calls
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+class Histogram:
+    """Minimal labelled latency histogram (Prometheus-style cumulative buckets)."""
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # sorted label items -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            row = self.series.get(key)
+            if row is None:
+                row = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            row[i] += 1
+            row[-1] += value
+
+    def snapshot(self):
+        """{'label=value,...': {'count', 'sum', 'buckets': {le: cumulative count}}}"""
+        out = {}
+        with self.lock:
+            items = [(key, list(row)) for key, row in self.series.items()]
+        for key, row in items:
+            cumulative, buckets = 0, {}
+            for le, n in zip(self.buckets + (float('inf'),), row[:-1]):
+                cumulative += n
+                buckets[str(le)] = cumulative
+            out[','.join(f"{k}={v}" for k, v in key)] = {"count": cumulative, "sum": row[-1], "buckets": buckets}
+        return out
+
+    def exposition(self):
+        """Prometheus text-format lines for this histogram."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(key, list(row)) for key, row in self.series.items()]
+        for key, row in sorted(items):
+            labels = ''.join(f'{k}="{_escape(v)}",' for k, v in key)
+            cumulative = 0
+            for le, n in zip(self.buckets + (float('inf'),), row[:-1]):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{labels}le="{"+Inf" if le == float("inf") else le}"}} {cumulative}')
+            labels = '{' + labels.rstrip(',') + '}' if labels else ''
+            lines += [f"{self.name}_sum{labels} {row[-1]}", f"{self.name}_count{labels} {cumulative}"]
+        return lines
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def render():
+    """Every registered histogram in the Prometheus text exposition format, for GET /metrics."""
+    return '\n'.join(line for histogram in REGISTRY for line in histogram.exposition()) + '\n'
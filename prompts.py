@@ -1,3 +1,5 @@
+NO_ANSWER = "I don't know — please contact support."
+
 RAG_PROMPT = """You are a bank policy assistant. Use ONLY the RAG CONTEXTS below to answer the user's question.
 If the answer cannot be found in contexts, respond: 'I don't know — please contact support.'
 
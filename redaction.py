@@ -0,0 +1,82 @@
+import re
+
+# (kind, mask, pattern) in priority order: keys are numbered card masks first,
+# then SSN, phone and email, each in order of appearance, as the original
+# one-pass-per-pattern redactor did. Every pattern is anchored so a match
+# attempt does bounded work: digit patterns only start at a word boundary and
+# read at most 37 characters, and the email local part only starts where a
+# run of local-part characters starts, so no start position is rescanned.
+PII_PATTERNS = [
+    ("card",  '<CARD_MASK>',  r"\b\d(?:[ -]?\d){12,18}\b"),
+    ("ssn",   '<SSN_MASK>',   r"\b\d{3}-\d{2}-\d{4}\b"),
+    ("phone", '<PHONE_MASK>', r"\b\d{10}\b"),
+    ("email", '<EMAIL_MASK>', r"(?<![A-Za-z0-9._%+-])[._%+-]*(?P<email>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b)"),
+]
+# a 13-19 digit run that fails the Luhn check is searched for a valid card starting at a later digit
+# group ("ref 12 4111 1111 1111 1111") or an SSN/phone inside it; failing both it is still masked as a card
+CARD_LUHN = True
+
+MASKS = {kind: mask for kind, mask, _ in PII_PATTERNS}
+DIGIT_START = r"\b\d"
+PRIORITY = {kind: i for i, (kind, _, _) in enumerate(PII_PATTERNS)}
+
+def _alternation(patterns):
+    # the digit patterns share their \b\d prefix, so it is tested once per position instead of once per pattern
+    digit = [f"(?P<{kind}>{p[2:]})" for kind, _, p in patterns if p.startswith(DIGIT_START)]
+    other = [p if '(?P<' in p else f"(?P<{kind}>{p})" for kind, _, p in patterns if not p.startswith(DIGIT_START)]
+    return re.compile('|'.join(([r"\b(?=\d)(?:" + '|'.join(digit) + ")"] if digit else []) + other))
+
+PII_RE = _alternation(PII_PATTERNS)
+NON_CARD_RE = _alternation(PII_PATTERNS[1:])
+CARD_RE = re.compile(PII_PATTERNS[0][2])
+# ASCII digit -> ASCII digit sum of twice that digit
+_LUHN_DOUBLE = bytes.maketrans(b"0123456789", b"0246813579")
+
+def luhn_valid(number):
+    digits = number.encode('ascii').translate(None, b' -')[::-1]
+    return (sum(digits[0::2]) + sum(digits[1::2].translate(_LUHN_DOUBLE)) - 48 * len(digits)) % 10 == 0
+
+def find_pii(text, luhn=CARD_LUHN):
+    """(kind, start, end) of every PII match, found in a single left-to-right scan."""
+    found, pos = [], 0
+    while True:
+        m = PII_RE.search(text, pos)
+        if m is None:
+            return found
+        kind = m.lastgroup
+        if kind == 'card' and luhn and not luhn_valid(m.group('card')):
+            kind, start, end = _rejected_card(text, m)
+        else:
+            start, end = m.span(kind)
+        found.append((kind, start, end))
+        pos = end
+
+def _rejected_card(text, m):
+    """(kind, start, end) for a card-shaped run failing Luhn: the first Luhn-valid card from a later digit
+    group or SSN/phone inside it, else the whole run as a card. A run is at most 37 characters."""
+    for start in range(m.start(), m.end()):
+        if start > m.start() and text[start-1] in ' -':
+            card = CARD_RE.match(text, start)
+            if card and luhn_valid(card.group()):
+                return ('card', *card.span())
+        other = NON_CARD_RE.match(text, start)
+        if other:
+            return (other.lastgroup, *other.span(other.lastgroup))
+    return ('card', *m.span())
+
+def redact_pii(text, luhn=CARD_LUHN):
+    """Replace PII with numbered mask keys; returns (redacted text, {key: original})."""
+    found = find_pii(text, luhn)
+    if not found:
+        return text, {}
+    keys, replacements = {}, {}
+    for n, (kind, start, end) in enumerate(sorted(found, key=lambda f: (PRIORITY[f[0]], f[1])), 1):
+        keys[start] = f"{MASKS[kind]}_{n}"
+        replacements[keys[start]] = text[start:end]
+    out, pos = [], 0
+    for kind, start, end in found:
+        out.append(text[pos:start])
+        out.append(keys[start])
+        pos = end
+    out.append(text[pos:])
+    return ''.join(out), replacements
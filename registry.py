@@ -0,0 +1,125 @@
+import os, time, base64, threading, numpy as np
+import embedding_backends
+
+EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+# e.g. http://127.0.0.1:8002 to embed through one shared `uvicorn embed_worker:app` process
+EMBED_WORKER_URL = os.environ.get("EMBED_WORKER_URL")
+
+# seconds between checks for a newly published index snapshot; 0 disables the watcher
+RELOAD_POLL_S = float(os.environ.get("INDEX_RELOAD_POLL_S", "2"))
+
+_lock = threading.RLock()
+_reload_lock = threading.Lock()  # one snapshot load at a time, without blocking get_retriever()
+_models = {}
+_retriever = None
+
+class RemoteEmbedder:
+    """SentenceTransformer-compatible encode() backed by the embed_worker service."""
+    def __init__(self, url, timeout=30):
+        import requests
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def encode(self, sentences, batch_size=64, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        r = self.session.post(f"{self.url}/embed", json={"texts": texts, "batch_size": batch_size}, timeout=self.timeout)
+        r.raise_for_status()
+        return decode_embeddings(r.json())[0] if single else decode_embeddings(r.json())
+
+def encode_embeddings(X):
+    X = np.ascontiguousarray(X, dtype='float32')
+    return {"shape": list(X.shape), "data": base64.b64encode(X.tobytes()).decode('ascii')}
+
+def decode_embeddings(payload):
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype='float32').reshape(payload["shape"])
+
+def get_model(name=EMBED_MODEL_NAME, remote=True, backend=None):
+    """Process-wide embedding model, created on first use.
+
+    torch and sentence-transformers are only imported by these getters, so importing the
+    orchestrator stays cheap; with EMBED_WORKER_URL set (and remote=True) no
+    model is loaded in this process at all. backend (default EMBED_BACKEND)
+    picks torch, onnx or onnx-int8, see embedding_backends.
+    """
+    remote = bool(remote and EMBED_WORKER_URL)
+    key = (name, remote, None if remote else backend or embedding_backends.EMBED_BACKEND)
+    with _lock:
+        if key not in _models:
+            if remote:
+                _models[key] = RemoteEmbedder(EMBED_WORKER_URL)
+            else:
+                _models[key] = embedding_backends.load_model(name, key[2])
+        return _models[key]
+
+def get_cross_encoder(name):
+    """Process-wide sentence-transformers CrossEncoder (for reranker.py), created on first use."""
+    key = ("cross-encoder", name)
+    with _lock:
+        if key not in _models:
+            from sentence_transformers import CrossEncoder
+            _models[key] = CrossEncoder(name)
+        return _models[key]
+
+def get_retriever():
+    """Process-wide Retriever over the current index, created on first use."""
+    global _retriever
+    with _lock:
+        if _retriever is None:
+            from retriever import Retriever
+            _retriever = Retriever()
+        return _retriever
+
+def reload_retriever(force=False):
+    """Swap in a Retriever over the currently published snapshot; returns its version.
+
+    The new index is loaded before the swap, so requests never wait on it;
+    requests already holding the old Retriever finish on it and it is freed
+    once they drop it. A no-op when the loaded version is already current.
+    """
+    global _retriever
+    import snapshots
+    from retriever import Retriever
+    old = _retriever
+    if old is not None and not force and old.version == snapshots.current_version():
+        return old.version
+    with _reload_lock:
+        fresh = Retriever(query_cache=old.query_cache if old is not None else None)
+        with _lock:
+            _retriever = fresh
+    print(f"Index reloaded: {old.version if old else None} -> {fresh.version}")
+    return fresh.version
+
+def watch_index(interval=RELOAD_POLL_S):
+    """Background thread that reloads the Retriever whenever ingest publishes a new snapshot."""
+    import snapshots
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                if _retriever is not None and _retriever.version != snapshots.current_version():
+                    reload_retriever()
+            except Exception as e:
+                print(f"Index reload failed (keeping {_retriever.version}): {e}")
+    t = threading.Thread(target=run, name="index-watch", daemon=True)
+    t.start()
+    return t
+
+def loaded_retriever():
+    """The Retriever if one has been loaded, without triggering a load."""
+    return _retriever
+
+def warm_up(background=True):
+    """Load the model and index and run one query so the first request is not a cold start."""
+    def run():
+        try:
+            get_retriever().embed("warm up")
+            print("Model and index warmed up")
+        except Exception as e:
+            print(f"Warm-up failed (will retry on first request): {e}")
+    if not background:
+        return run()
+    t = threading.Thread(target=run, name="warm-up", daemon=True)
+    t.start()
+    return t
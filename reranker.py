@@ -0,0 +1,91 @@
+import os, time, threading
+from collections import OrderedDict
+import registry, tracing
+from metrics import Histogram
+from retriever import normalize_query
+
+# Optional second stage: over-fetch RERANK_CANDIDATES chunks, score each (query, chunk) pair with a
+# cross-encoder and keep the best RERANK_TOP_K for the prompt. Off unless RERANK=1.
+RERANK = os.environ.get("RERANK") == "1"
+RERANK_MODEL_NAME = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = 20
+RERANK_TOP_K = 3
+RERANK_BATCH_SIZE = 32
+RERANK_CACHE_SIZE = 8192
+
+RERANK_LATENCY = Histogram("rerank_latency_seconds", "Cross-encoder re-ranking time per request")
+
+class Reranker:
+    """Cross-encoder re-ranker with an LRU of (normalised query, chunk id) -> score.
+
+    Chunk ids are fresh uuids for every ingested chunk, so a cached score
+    can never belong to different text; only uncached pairs reach the model,
+    all of them in one predict() call.
+    """
+    def __init__(self, model_name=RERANK_MODEL_NAME, cache_size=RERANK_CACHE_SIZE, batch_size=RERANK_BATCH_SIZE):
+        self.model_name = model_name
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def model(self):
+        return registry.get_cross_encoder(self.model_name)
+
+    def warm_up(self):
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+
+    def scores(self, pairs):
+        """Relevance scores for [(query, meta)] pairs; higher is better."""
+        keys = [(normalize_query(q), m['id']) for q, m in pairs]
+        out = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    out[key] = self.entries[key]
+            self.hits += sum(key in out for key in keys)
+            self.misses += sum(key not in out for key in keys)
+        missing = {key: m['text'] for key, (_, m) in zip(keys, pairs) if key not in out}
+        if missing:
+            # the model sees the same lower-cased query the cache keys on
+            predicted = self.model.predict([(q, text) for (q, _), text in missing.items()],
+                                           batch_size=self.batch_size, show_progress_bar=False)
+            fresh = dict(zip(missing, map(float, predicted)))
+            out.update(fresh)
+            with self.lock:
+                self.entries.update(fresh)
+                for key in fresh:
+                    self.entries.move_to_end(key)
+                while len(self.entries) > self.cache_size:
+                    self.entries.popitem(last=False)
+        return [out[key] for key in keys]
+
+    def rerank(self, query, metas, top_k=RERANK_TOP_K):
+        """(best top_k metas by cross-encoder score, seconds spent)."""
+        batch, seconds = self.rerank_many([query], [metas], top_k)
+        return batch[0], seconds
+
+    @tracing.traced("rerank")
+    def rerank_many(self, queries, batch, top_k=RERANK_TOP_K):
+        """rerank() for many queries with a single predict() call; seconds are for the whole batch."""
+        t0 = time.perf_counter()
+        pairs = [(q, m) for q, metas in zip(queries, batch) for m in metas]
+        scores = iter(self.scores(pairs))
+        out = []
+        for metas in batch:
+            for m in metas:
+                m['rerank_score'] = next(scores)
+            out.append(sorted(metas, key=lambda m: -m['rerank_score'])[:top_k])
+        seconds = time.perf_counter() - t0
+        RERANK_LATENCY.observe(seconds, batch="1" if len(queries) == 1 else "n")
+        return out, seconds
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"model": self.model_name, "size": len(self.entries), "maxsize": self.cache_size, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "latency": RERANK_LATENCY.snapshot()}
@@ -1,30 +1,301 @@
-import faiss, json, numpy as np
-from sentence_transformers import SentenceTransformer
+import os, re, faiss, json, threading, numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import registry
+from chunk_store import ChunkStore, STORE_DIR
+import index_factory
+import embedding_backends
+import snapshots
+import bm25
+import tracing
 
 INDEX_PATH = "faiss_index.bin"
 META_PATH = "faiss_meta.json"
 RAW_PATH = "faiss_raw.json"
-EMBED_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBED_MODEL_NAME = registry.EMBED_MODEL_NAME
+# int8 embeddings differ slightly from fp32 ones, so persisted query embeddings are kept per backend
+EMBED_MODEL_TAG = f"{EMBED_MODEL_NAME}:{embedding_backends.EMBED_BACKEND}"
+# Chunks whose cosine similarity to the query is below this never reach the prompt
+MIN_SCORE = 0.25
+QUERY_CACHE_SIZE = 1024
+# set to e.g. query_cache.npz to keep cached query embeddings across restarts
+QUERY_CACHE_PATH = os.environ.get("QUERY_CACHE_PATH")
+# fuse BM25 with vector results when the snapshot has a BM25 index; HYBRID_RETRIEVAL=0 turns it off
+HYBRID = os.environ.get("HYBRID_RETRIEVAL", "1") != "0"
+# candidates each side contributes to the fusion; top_k of the fused list are returned
+HYBRID_CANDIDATES = 20
+# BM25 runs here while the calling thread embeds the query and searches FAISS
+LEXICAL_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+# chunks of PDFs directly in pdfs/ are visible to everyone; pdfs/<account_id>/ ones only to that account
+SHARED_PARTITION = ""
+
+def visible_partitions(account_id=None):
+    return (SHARED_PARTITION,) if not account_id else (SHARED_PARTITION, account_id)
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+class EmbeddingCache:
+    """Thread-safe LRU of normalised query text -> query embedding.
+
+    With a path the entries are loaded on start-up and written back by
+    save(), tagged with the model name so a model change starts cold.
+    """
+    def __init__(self, maxsize=QUERY_CACHE_SIZE, path=None, model_name=EMBED_MODEL_TAG):
+        self.maxsize = maxsize
+        self.path = path
+        self.model_name = model_name
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key):
+        with self.lock:
+            emb = self.entries.get(key)
+            if emb is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return emb
+
+    def put(self, key, emb):
+        emb.setflags(write=False)
+        with self.lock:
+            self.entries[key] = emb
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def load(self):
+        try:
+            data = np.load(self.path)
+            if str(data["model"]) != self.model_name:
+                return
+            for key, emb in zip(data["keys"], data["embs"]):
+                self.put(str(key), np.array(emb, dtype='float32'))
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Ignoring unreadable query cache {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            keys = list(self.entries)
+            embs = np.stack(list(self.entries.values())) if keys else np.zeros((0, 0), dtype='float32')
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, model=np.array(self.model_name), keys=np.array(keys, dtype=str), embs=embs)
+        os.replace(tmp, self.path)
 
 class Retriever:
-    def __init__(self):
-        self.model = SentenceTransformer(EMBED_MODEL_NAME)
-        self.index = faiss.read_index(INDEX_PATH)
-        with open(META_PATH,'r',encoding='utf8') as f:
-            self.metas = json.load(f)
-        with open(RAW_PATH,'r',encoding='utf8') as f:
-            self.raw = json.load(f)
-
-    def retrieve(self, query, top_k=4):
-        q_emb = self.model.encode(query)
+    def __init__(self, query_cache_size=QUERY_CACHE_SIZE, query_cache_path=QUERY_CACHE_PATH, snapshot=None, query_cache=None,
+                 hybrid=HYBRID):
+        self.model = registry.get_model(EMBED_MODEL_NAME)  # shared with every other user in this process
+        # query embeddings do not depend on the index, so a reload can hand over the old cache
+        self.query_cache = query_cache or EmbeddingCache(query_cache_size, query_cache_path)
+        # read once from one snapshot; a later ingest publishes a new one instead of rewriting these files
+        self.snapshot = Path(snapshot or snapshots.current_dir())
+        # any index type built by index_factory; nprobe/efSearch come from the persisted params
+        self.index, self.index_params = index_factory.load_index(self.snapshot / INDEX_PATH, self.snapshot / index_factory.PARAMS_PATH)
+        # caches derived from search results key on it
+        self.version = self.snapshot.name if self.snapshot != Path(".") else snapshots.current_version()
+        store_dir = self.snapshot / STORE_DIR
+        self.store = ChunkStore(store_dir) if ChunkStore.exists(store_dir) else None
+        if self.store is None:
+            # legacy JSON metadata (see `python chunk_store.py migrate`)
+            with open(self.snapshot / META_PATH,'r',encoding='utf8') as f:
+                self.metas = json.load(f)
+            with open(self.snapshot / RAW_PATH,'r',encoding='utf8') as f:
+                self.raw = json.load(f)
+            # IndexIDMap labels are stable vector ids; legacy flat indexes return row positions
+            self.row_of = {m['vid']: i for i, m in enumerate(self.metas) if 'vid' in m}
+        # storage=sq8/pq indexes with "refine": candidates are re-scored against the float32 embeddings,
+        # memory-mapped so only the candidate rows are read and the pages are shared between workers
+        self.exact = None
+        if self.index_params.get("refine", 1) > 1 and self.store is not None:
+            self.exact = np.load(self.snapshot / index_factory.EMB_PATH, mmap_mode='r')
+        # built by ingest next to the FAISS index; snapshots from before it are vector-only
+        bm25_path = self.snapshot / bm25.BM25_PATH
+        self.bm25 = bm25.BM25Index.load(bm25_path) if hybrid and self.store is not None and bm25_path.exists() else None
+        self.filters = {}  # frozenset of partitions -> search restrictions, see partition_filter()
+
+    def chunk(self, label):
+        """Metadata plus full text for a FAISS label, or None if it is unknown."""
+        if self.store is not None:
+            row = self.store.row_of(label)
+            return None if row is None else self.store.meta(row)
+        meta = self.metas[self.row_of.get(label, label)].copy()
+        meta['text'] = self.raw.get(meta['id'], meta.get('text_preview',''))
+        return meta
+
+    @tracing.traced("embed")
+    def embed(self, query):
+        """L2-normalised float32 query embedding, shape (dim,); repeat queries skip the model."""
+        key = normalize_query(query)
+        cached = self.query_cache.get(key)
+        if cached is not None:
+            return cached
+        q_emb = self.model.encode(key)  # MiniLM is uncased, so lowercasing the key is lossless
         # Ensure embedding is a numpy array and convert to float32
         if not isinstance(q_emb, np.ndarray):
             q_emb = np.array(q_emb)
-        q_emb = q_emb.astype('float32')
-        D,I = self.index.search(np.expand_dims(q_emb,axis=0), top_k)
-        results=[]
-        for idx in I[0]:
-            meta = self.metas[idx].copy()
-            meta['text'] = self.raw.get(meta['id'], meta.get('text_preview',''))
+        q_emb = np.expand_dims(q_emb.astype('float32'), axis=0)
+        faiss.normalize_L2(q_emb)
+        self.query_cache.put(key, q_emb[0])
+        return q_emb[0]
+
+    @tracing.traced("embed")
+    def embed_many(self, queries, batch_size=64):
+        """embed() for many queries at once: cache misses go through the model in a single encode call."""
+        keys = [normalize_query(q) for q in queries]
+        out = [self.query_cache.get(k) for k in keys]
+        missing = list(dict.fromkeys(k for k, e in zip(keys, out) if e is None))
+        if missing:
+            X = np.asarray(self.model.encode(missing, batch_size=batch_size, convert_to_numpy=True), dtype='float32')
+            X = np.ascontiguousarray(X.reshape(len(missing), -1))
+            faiss.normalize_L2(X)
+            fresh = dict(zip(missing, X))
+            for k, e in fresh.items():
+                self.query_cache.put(k, e)
+            out = [fresh[k] if e is None else e for k, e in zip(keys, out)]
+        return np.stack(out) if out else np.zeros((0, self.index.d), dtype='float32')
+
+    def partition_filter(self, partitions):
+        """Restrictions for searching only chunks in partitions, or None when that is every chunk.
+
+        Built once per partition set from the chunk store's partition column:
+        the vids, an IDSelector over them (None if the index type cannot take
+        one) and a BM25 row mask. The selector is shared by concurrent searches;
+        SearchParameters are not (see search_many).
+        """
+        if partitions is None or self.store is None:
+            return None
+        key = frozenset(partitions)
+        if key not in self.filters:
+            vids = self.store.vids_in(key)
+            if len(vids) == len(self.store):
+                self.filters[key] = None
+            else:
+                self.filters[key] = {"vids": vids,
+                                     "sel": faiss.IDSelectorBatch(vids)
+                                            if len(vids) and index_factory.supports_selector(self.index_params) else None,
+                                     "mask": np.isin(self.bm25.vids, vids) if self.bm25 is not None else None}
+        return self.filters[key]
+
+    def search(self, q_emb, top_k=4, min_score=MIN_SCORE, partitions=None):
+        """Chunks for a query embedding, best first, each with its cosine 'score'."""
+        return self.search_many(np.expand_dims(q_emb,axis=0), top_k, min_score, partitions)[0]
+
+    @tracing.traced("faiss_search")
+    def search_many(self, Q, top_k=4, min_score=MIN_SCORE, partitions=None):
+        """search() for a (n, dim) matrix of query embeddings in one index.search call.
+
+        With partitions only chunks in those partitions are searched (pre-filtered
+        through an IDSelector, so other vectors are never scored).
+        """
+        if not len(Q):
+            return []
+        Q = np.ascontiguousarray(Q, dtype='float32')
+        filt = self.partition_filter(partitions)
+        if filt is not None and not len(filt["vids"]):
+            return [[] for _ in Q]
+        fetch = top_k * self.index_params["refine"] if self.exact is not None else top_k
+        if filt is None:
+            D,I = self.index.search(Q, fetch)
+        elif filt["sel"] is not None:
+            # fresh params per call: IndexIDMap swaps params.sel for a call-local selector while it searches
+            D,I = self.index.search(Q, fetch, params=index_factory.search_params(self.index_params, filt["sel"]))
+        else:
+            # no IDSelector support: over-fetch in proportion to the partition's share, then drop the rest
+            more = min(self.index.ntotal, 2 * fetch * -(-self.index.ntotal // len(filt["vids"])))
+            D,I = self.index.search(Q, more)
+            I = np.where(np.isin(I, filt["vids"]), I, -1)
+        if self.exact is not None:
+            D,I = index_factory.refine(Q, I, self.exact, self.store.vid, top_k, self.index.metric_type)
+        scores = index_factory.similarity(D, self.index.metric_type)
+        batch = []
+        for row_scores, row_ids in zip(scores, I):
+            results=[]
+            for score, idx in zip(row_scores, row_ids):
+                if idx < 0 or score < min_score:
+                    continue
+                meta = self.chunk(int(idx))
+                if meta is not None:
+                    meta['score'] = float(score)
+                    results.append(meta)
+                    if len(results) == top_k:
+                        break
+            batch.append(results)
+        return batch
+
+    def lookup(self, query, top_k=4, min_score=MIN_SCORE, partitions=None):
+        """(query embedding, chunks) for a query: hybrid when a BM25 index is loaded, else search().
+
+        BM25 runs concurrently with embedding and the FAISS search, each side
+        contributes HYBRID_CANDIDATES hits and the top_k of their reciprocal
+        rank fusion are returned, with the fused 'score' plus 'vector_score'
+        (cosine, None if only BM25 found it) and 'bm25_score'. Both sides are
+        limited to partitions when given (see visible_partitions).
+        """
+        if self.bm25 is None:
+            q_emb = self.embed(query)
+            return q_emb, self.search(q_emb, top_k, min_score, partitions)
+        filt = self.partition_filter(partitions)
+        lexical = LEXICAL_EXECUTOR.submit(tracing.bind(self.bm25.search), query, HYBRID_CANDIDATES, bm25.BM25_MIN_SCORE,
+                                          filt["mask"] if filt else None)
+        q_emb = self.embed(query)
+        vector = self.search(q_emb, max(top_k, HYBRID_CANDIDATES), min_score, partitions)
+        return q_emb, self.fuse(vector, lexical.result(), top_k)
+
+    def lookup_many(self, queries, top_k=4, min_score=MIN_SCORE, partitions=None):
+        """lookup() for a batch: one encode call, one FAISS search per distinct partition set and the BM25 searches alongside.
+
+        partitions, if given, holds one partition set (or None) per query.
+        """
+        keys = [None if p is None else frozenset(p) for p in (partitions or [None] * len(queries))]
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+        lexical = None
+        if self.bm25 is not None:
+            masks = [(self.partition_filter(key) or {}).get("mask") for key in keys]
+            lexical = LEXICAL_EXECUTOR.submit(tracing.bind(self.bm25.search_many), queries, HYBRID_CANDIDATES, bm25.BM25_MIN_SCORE, masks)
+        Q = self.embed_many(queries)
+        fetch = top_k if lexical is None else max(top_k, HYBRID_CANDIDATES)
+        vector = [None] * len(queries)
+        for key, rows in groups.items():
+            for i, results in zip(rows, self.search_many(Q[rows], fetch, min_score, key)):
+                vector[i] = results
+        if lexical is None:
+            return Q, vector
+        return Q, [self.fuse(v, l, top_k) for v, l in zip(vector, lexical.result())]
+
+    def fuse(self, vector, lexical, top_k=4):
+        """Reciprocal rank fusion of search() results and BM25 (vid, score) hits, best first."""
+        by_vid = {m['vid']: m for m in vector}
+        bm25_score = dict(lexical)
+        fused = bm25.rrf([[m['vid'] for m in vector], [vid for vid, _ in lexical]])
+        results = []
+        for vid, score in sorted(fused.items(), key=lambda kv: -kv[1]):
+            meta = by_vid.get(vid) or self.chunk(vid)
+            if meta is None:
+                continue
+            meta['vector_score'] = meta.get('score') if vid in by_vid else None
+            meta['bm25_score'] = bm25_score.get(vid)
+            meta['score'] = score
             results.append(meta)
+            if len(results) == top_k:
+                break
         return results
+
+    def retrieve(self, query, top_k=4, min_score=MIN_SCORE, partitions=None):
+        return self.lookup(query, top_k, min_score, partitions)[1]
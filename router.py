@@ -0,0 +1,121 @@
+import os, threading
+from collections import deque
+import numpy as np
+
+# keyword -> (does it make the message an action?, action it points to)
+# Matching is on the lower-cased text, by substring, like the original `kw in text` checks.
+ROUTE_KEYWORDS = {
+    'block card':    (True,  'block_card'),
+    'block my card': (True,  'block_card'),
+    'freeze card':   (True,  None),
+    'dispute':       (True,  'raise_dispute'),
+    'raise dispute': (True,  'raise_dispute'),
+    'report fraud':  (True,  'raise_dispute'),
+    'cancel card':   (True,  None),
+    'get balance':   (True,  'get_balance'),
+    'balance':       (True,  'get_balance'),
+    'transfer':      (True,  None),
+    # only picks the action once another keyword made it an action ("freeze card and block it")
+    'block':         (False, 'block_card'),
+}
+# when several actions are mentioned the first one in this list wins
+ACTION_PRIORITY = ['block_card', 'get_balance', 'raise_dispute']
+
+# Nearest-centroid fallback for phrasings the keywords miss ("my card was stolen, stop it").
+# It reuses the query embedding retrieval computes anyway; off unless ROUTER_EMBED_FALLBACK=1.
+EMBED_FALLBACK = os.environ.get("ROUTER_EMBED_FALLBACK") == "1"
+CENTROID_MIN_SIM = 0.55   # cosine to the best action centroid
+CENTROID_MARGIN = 0.05    # ...and by how much it must beat the FAQ centroid
+ROUTE_EXAMPLES = {
+    'faq': ["what is the atm withdrawal limit", "what are the charges for a debit card",
+            "how do i open a savings account", "what is the interest rate on fixed deposits",
+            "what documents are needed for a loan"],
+    'block_card': ["my card was stolen", "i lost my debit card", "stop my credit card immediately",
+                   "someone is using my card without permission", "deactivate my card"],
+    'get_balance': ["how much money do i have", "what is left in my account", "show my account funds",
+                    "check my savings", "how much can i spend right now"],
+    'raise_dispute': ["i was charged twice", "i don't recognise this transaction", "wrong amount was debited",
+                      "refund a transaction i did not make", "merchant charged me incorrectly"],
+}
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton: every keyword occurring in a text, found in one pass over it."""
+    def __init__(self, keywords):
+        self.goto = [{}]
+        self.out = [[]]
+        for kw in keywords:
+            node = 0
+            for c in kw:
+                if c not in self.goto[node]:
+                    self.goto.append({})
+                    self.out.append([])
+                    self.goto[node][c] = len(self.goto) - 1
+                node = self.goto[node][c]
+            self.out[node].append(kw)
+        self.fail = [0] * len(self.goto)
+        todo = deque(self.goto[0].values())
+        while todo:
+            node = todo.popleft()
+            for c, child in self.goto[node].items():
+                todo.append(child)
+                f = self.fail[node]
+                while f and c not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f][c] if c in self.goto[f] and self.goto[f][c] != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, text):
+        """Set of keywords that occur in text."""
+        goto, fail, out = self.goto, self.fail, self.out
+        found, node = set(), 0
+        for c in text:
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+class Router:
+    """Maps a message to (intent, action): intent is 'action' or 'faq', action a tool name or None."""
+    def __init__(self, keywords=ROUTE_KEYWORDS, embed_fallback=EMBED_FALLBACK):
+        self.keywords = keywords
+        self.automaton = KeywordAutomaton(keywords)
+        self.embed_fallback = embed_fallback
+        self.centroids = None  # (labels, unit-norm centroid matrix), built on first fallback
+        self.lock = threading.Lock()
+
+    def route(self, text, q_emb=None):
+        found = self.automaton.find(text.lower())
+        if any(self.keywords[kw][0] for kw in found):
+            actions = {self.keywords[kw][1] for kw in found}
+            return 'action', next((a for a in ACTION_PRIORITY if a in actions), None)
+        if q_emb is not None and self.embed_fallback:
+            return self.nearest(q_emb)
+        return 'faq', None
+
+    def nearest(self, q_emb):
+        labels, C = self._centroids()
+        sims = C @ q_emb
+        best = int(np.argmax(sims))
+        faq = sims[labels.index('faq')]
+        if labels[best] != 'faq' and sims[best] >= CENTROID_MIN_SIM and sims[best] - faq >= CENTROID_MARGIN:
+            return 'action', labels[best]
+        return 'faq', None
+
+    def warm_up(self):
+        """Build the centroids now (off the event loop) instead of inside the first fallback route."""
+        if self.embed_fallback:
+            self._centroids()
+
+    def _centroids(self):
+        with self.lock:
+            if self.centroids is None:
+                import registry
+                ret = registry.get_retriever()
+                labels = list(ROUTE_EXAMPLES)
+                C = np.stack([ret.embed_many(ROUTE_EXAMPLES[label]).mean(axis=0) for label in labels])
+                self.centroids = labels, C / np.linalg.norm(C, axis=1, keepdims=True)
+            return self.centroids
+
+ROUTER = Router()
@@ -1,9 +1,31 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-import uuid, requests
-from agents import classify_intent, redact_pii, AnswerAgent, ActionAgent
+import uuid, json, time, asyncio, requests
+import tools, registry, tracing, metrics
+from agents import redact_pii, AnswerAgent, ActionAgent, LLM_BATCH_CONCURRENCY, RETRIEVAL_EXECUTOR
+from router import ROUTER
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # load model + index on a background thread so the server accepts connections immediately
+    registry.warm_up()
+    tracing.setup_otel()
+    RETRIEVAL_EXECUTOR.submit(ROUTER.warm_up)
+    if answer_agent.reranker is not None:
+        RETRIEVAL_EXECUTOR.submit(answer_agent.reranker.warm_up)
+    # pick up indexes published by ingest.py / the Streamlit upload without a restart
+    if registry.RELOAD_POLL_S > 0:
+        registry.watch_index()
+    yield
+    await tools.aclose()
+    # keep cached query embeddings for the next start (when QUERY_CACHE_PATH is set)
+    if registry.loaded_retriever() is not None:
+        registry.loaded_retriever().query_cache.save()
+    tracing.shutdown_otel()
+
+app = FastAPI(lifespan=lifespan)
 answer_agent = AnswerAgent()
 action_agent = ActionAgent()
 
@@ -13,26 +35,185 @@ class ChatRequest(BaseModel):
     account_id: str | None = None
     authenticated: bool = False
 
+async def route(text, redacted):
+    """(intent, action) for a message; one keyword pass, plus the embedding fallback for FAQ-looking text.
+
+    The fallback embeds the redacted text exactly as retrieval will, so the
+    FAQ path then finds the embedding in the query cache instead of encoding again.
+    """
+    with tracing.span("classify_intent"):
+        intent, action = ROUTER.route(text)
+    if intent == 'faq' and ROUTER.embed_fallback:
+        loop = asyncio.get_running_loop()
+        [(intent, action)] = await loop.run_in_executor(RETRIEVAL_EXECUTOR, tracing.bind(_embed_routes), [text], [redacted])
+    return intent, action
+
+def _embed_routes(texts, redacted):
+    """Embedding-fallback routes; runs on RETRIEVAL_EXECUTOR, since the first call may load the index and build the centroids."""
+    Q = answer_agent.ret.embed_many(redacted)
+    with tracing.span("classify_intent"):
+        return [ROUTER.route(text, q_emb) for text, q_emb in zip(texts, Q)]
+
+def document_account(req):
+    """Account whose private documents (pdfs/<account_id>/) a FAQ may draw on; shared documents only until authenticated."""
+    return req.account_id if req.authenticated else None
+
+async def run_action(req, session_id, action):
+    if action == 'block_card':
+        if not req.authenticated or not req.account_id:
+            return {"session_id":session_id, "intent":"action","status":"needs_auth"}
+        card_last4 = '4242'
+        res = await action_agent.aexecute('block_card', {"account_id":req.account_id, "card_last4":card_last4, "reason":"Customer request"})
+        return {"session_id":session_id, "intent":"action","action_result":res}
+    if action == 'get_balance':
+        if not req.authenticated or not req.account_id:
+            return {"session_id":session_id, "intent":"action","status":"needs_auth"}
+        res = await action_agent.aexecute('get_balance', {"account_id":req.account_id})
+        return {"session_id":session_id, "intent":"action","action_result":res}
+    return {"session_id":session_id, "intent":"unknown"}
+
+def _debug(value):
+    return value not in (None, "0")
+
 @app.post('/chat')
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest, debug_timings: str | None = Header(None, alias=tracing.DEBUG_HEADER)):
+    # async end to end: LLM and banking calls are awaited, embedding/FAISS run on agents.RETRIEVAL_EXECUTOR
+    with tracing.request("/chat") as timings:
+        result = await _chat(req)
+    if _debug(debug_timings):
+        result["timings"] = timings
+    return result
+
+async def _chat(req):
     session_id = req.session_id or str(uuid.uuid4())
-    intent = classify_intent(req.user_text)
-    redacted, replacements = redact_pii(req.user_text)
+    with tracing.span("redact_pii"):
+        redacted, replacements = redact_pii(req.user_text)
+    intent, action = await route(req.user_text, redacted)
     print(" User Request Intenet ="+intent)
     if intent=='faq':
-        parsed, metas = answer_agent.answer(redacted)
+        parsed, metas = await answer_agent.aanswer(redacted, document_account(req))
         return {"session_id":session_id, "intent":intent, "response": parsed}
-    else:
-        # naive action routing for demo
-        if 'block' in redacted.lower():
-            if not req.authenticated or not req.account_id:
-                return {"session_id":session_id, "intent":"action","status":"needs_auth"}
-            card_last4 = '4242'
-            res = action_agent.execute('block_card', {"account_id":req.account_id, "card_last4":card_last4, "reason":"Customer request"})
-            return {"session_id":session_id, "intent":"action","action_result":res}
-        if 'balance' in redacted.lower():
-            if not req.authenticated or not req.account_id:
-                return {"session_id":session_id, "intent":"action","status":"needs_auth"}
-            res = action_agent.execute('get_balance', {"account_id":req.account_id})
-            return {"session_id":session_id, "intent":"action","action_result":res}
-        return {"session_id":session_id, "intent":"unknown"}
+    return await run_action(req, session_id, action)
+
+@app.post('/chat/stream')
+async def chat_stream(req: ChatRequest, debug_timings: str | None = Header(None, alias=tracing.DEBUG_HEADER)):
+    """Same routing as /chat, streamed as NDJSON events.
+
+    Events: {"type": "intent"}, then for FAQs {"type": "retrieval"} as soon as
+    chunks are found and {"type": "token"} per answer fragment, and finally
+    {"type": "final", "result": <the /chat response>}. With the debug header
+    the retrieval event and the result carry "timings".
+    """
+    session_id = req.session_id or str(uuid.uuid4())
+    async def events():
+        with tracing.request("/chat/stream") as timings:
+            with tracing.span("redact_pii"):
+                redacted, replacements = redact_pii(req.user_text)
+            intent, action = await route(req.user_text, redacted)
+            yield {"type": "intent", "session_id": session_id, "intent": intent}
+            if intent == 'faq':
+                async for event in answer_agent.astream(redacted, document_account(req)):
+                    if event["type"] == "answer":
+                        result = {"session_id":session_id, "intent":intent, "response": event["response"]}
+                        continue
+                    if event["type"] == "retrieval" and _debug(debug_timings):
+                        event["timings"] = dict(timings)
+                    yield event
+            else:
+                result = await run_action(req, session_id, action)
+        if _debug(debug_timings):
+            result["timings"] = timings
+        yield {"type": "final", "result": result}
+    return _ndjson(events())
+
+def _ndjson(events):
+    async def lines():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+class BatchRequest(BaseModel):
+    requests: list[ChatRequest]
+    concurrency: int = LLM_BATCH_CONCURRENCY
+
+@app.post('/chat/batch')
+async def chat_batch(batch: BatchRequest):
+    """Many /chat requests in one call, streamed back as NDJSON in completion order.
+
+    Each line is {"index": <position in requests>, "result": <the /chat response>}
+    (or "error" instead of "result") and "timings": the shared stages, the item's
+    own and total_s since the batch started. Batches are for offline evaluation,
+    so timings come without the debug header. FAQs share one embedding call and
+    one index search; at most `concurrency` LLM calls run at once.
+    """
+    t0 = time.perf_counter()
+    reqs = batch.requests
+    session_ids = [r.session_id or str(uuid.uuid4()) for r in reqs]
+    done = asyncio.Queue()
+
+    async def put(item, timings):
+        item["timings"] = {**timings, "total_s": time.perf_counter() - t0}
+        await done.put(item)
+
+    async def answer_faqs(faq, redacted):
+        pending = set(faq)
+        try:
+            async for pos, parsed, metas, timings in answer_agent.aanswer_many([redacted[i] for i in faq], max(1, batch.concurrency),
+                                                                               [document_account(reqs[i]) for i in faq]):
+                i = faq[pos]
+                pending.discard(i)
+                await put({"index": i, "result": {"session_id":session_ids[i], "intent":"faq", "response": parsed}}, timings)
+        except Exception as e:
+            for i in sorted(pending):
+                await put({"index": i, "error": f"{type(e).__name__}: {e}"}, {})
+
+    async def act(i, action):
+        with tracing.branch() as timings:
+            try:
+                item = {"index": i, "result": await run_action(reqs[i], session_ids[i], action)}
+            except Exception as e:
+                item = {"index": i, "error": f"{type(e).__name__}: {e}"}
+        await put(item, timings)
+
+    async def events():
+        with tracing.request("/chat/batch"):
+            with tracing.span("redact_pii"):
+                redacted = [redact_pii(r.user_text)[0] for r in reqs]
+            with tracing.span("classify_intent"):
+                routes = [ROUTER.route(r.user_text) for r in reqs]
+            faq = [i for i, (intent, _) in enumerate(routes) if intent == 'faq']
+            if faq and ROUTER.embed_fallback:
+                # one encode for every FAQ-looking text; aanswer_many finds these in the query cache
+                loop = asyncio.get_running_loop()
+                fallback = await loop.run_in_executor(RETRIEVAL_EXECUTOR, tracing.bind(_embed_routes),
+                                                      [reqs[i].user_text for i in faq], [redacted[i] for i in faq])
+                for i, route in zip(faq, fallback):
+                    routes[i] = route
+                faq = [i for i in faq if routes[i][0] == 'faq']
+            tasks = [asyncio.create_task(answer_faqs(faq, redacted))] if faq else []
+            tasks += [asyncio.create_task(act(i, action)) for i, (intent, action) in enumerate(routes) if intent != 'faq']
+            try:
+                for _ in reqs:
+                    yield await done.get()
+            finally:
+                for task in tasks:
+                    task.cancel()
+    return _ndjson(events())
+
+@app.get('/stats')
+def stats():
+    return {"query_embedding_cache": answer_agent.ret.query_cache.stats(),
+            "answer_cache": answer_agent.cache.stats(),
+            "reranker": answer_agent.reranker.stats() if answer_agent.reranker else None,
+            "tools": tools.stats()}
+
+@app.get('/metrics')
+def prometheus_metrics():
+    """Latency histograms (request stages, tool calls, re-ranking) for Prometheus to scrape."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.post('/admin/reload')
+def admin_reload(force: bool = False):
+    """Load the currently published index snapshot and swap it in; in-flight requests finish on the old one."""
+    previous = registry.loaded_retriever().version if registry.loaded_retriever() else None
+    return {"previous": previous, "version": registry.reload_retriever(force=force)}
@@ -0,0 +1,49 @@
+import os, time, shutil
+from pathlib import Path
+
+INDEX_ROOT = "index"
+CURRENT = "CURRENT"
+KEEP_SNAPSHOTS = 3
+
+# Every ingest writes a complete index (FAISS file, params, embeddings, file
+# fingerprints, chunk store) into a fresh index/snap-<ns>/ directory and then
+# atomically repoints index/CURRENT at it, so readers always see a matching
+# set of files. Trees from before snapshots keep their files in the working
+# directory, which is what current_dir() falls back to.
+
+def current_dir(root=INDEX_ROOT):
+    try:
+        with open(Path(root) / CURRENT,'r',encoding='utf8') as f:
+            return Path(root) / f.read().strip()
+    except OSError:
+        return Path(".")
+
+def current_version(root=INDEX_ROOT, index_name="faiss_index.bin"):
+    """Name of the published snapshot, or a file-mtime tag for a legacy index; None if there is none."""
+    d = current_dir(root)
+    if d != Path("."):
+        return d.name
+    try:
+        return f"legacy-{os.stat(index_name).st_mtime_ns}"
+    except OSError:
+        return None
+
+def new_snapshot(root=INDEX_ROOT):
+    d = Path(root) / f"snap-{time.time_ns()}"
+    d.mkdir(parents=True)
+    return d
+
+def publish(snapshot, root=INDEX_ROOT, keep=KEEP_SNAPSHOTS):
+    """Atomically make snapshot current, then prune all but the newest `keep` snapshots."""
+    root = Path(root)
+    tmp = root / f"{CURRENT}.{os.getpid()}.tmp"
+    with open(tmp,'w',encoding='utf8') as f:
+        f.write(Path(snapshot).name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, root / CURRENT)
+    snaps = sorted((p for p in root.glob("snap-*") if p.is_dir()), key=lambda p: int(p.name[5:]))
+    for old in snaps[:-keep] if keep else []:
+        if old.name != Path(snapshot).name:
+            # readers still on an old snapshot keep their open/mmapped files on POSIX
+            shutil.rmtree(old, ignore_errors=True)
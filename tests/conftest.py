@@ -0,0 +1,46 @@
+import sys, uuid, hashlib
+from pathlib import Path
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import registry, embedding_backends, index_factory, ingest
+
+class FakeModel:
+    """Deterministic bag-of-words encoder standing in for the sentence-transformers model."""
+    dim = 384
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, **kwargs):
+        single = isinstance(sentences, str)
+        out = np.zeros((1 if single else len(sentences), self.dim), dtype='float32')
+        for row, text in enumerate([sentences] if single else sentences):
+            for word in text.lower().split():
+                out[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+        return out[0] if single else out
+
+@pytest.fixture
+def model(monkeypatch):
+    m = FakeModel()
+    monkeypatch.setitem(registry._models, (registry.EMBED_MODEL_NAME, False, embedding_backends.EMBED_BACKEND), m)
+    monkeypatch.setattr(registry, "EMBED_WORKER_URL", None)
+    return m
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory, so index/ snapshots and caches land there."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def publish_index(model, chunks, kind="flat", **index_params):
+    """Publish a snapshot of [(source, text)] chunks; partitions follow ingest's folder naming."""
+    metas, raw_map = [], {}
+    for vid, (source, text) in enumerate(chunks):
+        id = str(uuid.uuid4())
+        metas.append({"id": id, "vid": vid, "source": source, "chunk_index": vid, "partition": ingest.partition_of(source),
+                      "text_preview": text[:300]})
+        raw_map[id] = text
+    X = ingest.embed_chunks(model, [text for _, text in chunks])
+    params = {**index_factory.make_params(kind), **index_params}
+    index = index_factory.build_index(X, [m['vid'] for m in metas], params)
+    return ingest.save_index(index, metas, raw_map, X, {}, params)
@@ -0,0 +1,50 @@
+import asyncio
+import agents, registry
+from agents import AnswerAgent
+from retriever import Retriever
+from conftest import publish_index
+
+def test_cancelled_batch_cancels_llm_calls(model, workdir, monkeypatch):
+    publish_index(model, [("shared.pdf", f"card fees policy section {i}") for i in range(10)])
+    monkeypatch.setattr(registry, "_retriever", Retriever())
+    started, cancelled = [], []
+
+    async def slow_llm(prompt):
+        started.append(prompt)
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+    monkeypatch.setattr(agents, "acall_llm", slow_llm)
+
+    async def run():
+        async def consume():
+            async for _ in AnswerAgent().aanswer_many([f"card fees section {i}" for i in range(4)], concurrency=2):
+                pass
+        batch = asyncio.create_task(consume())
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        batch.cancel()
+        await asyncio.gather(batch, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert len(cancelled) == len(started) == 2
+        assert not [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+    asyncio.run(run())
+
+def test_batch_lines_always_have_timings(model, workdir, monkeypatch):
+    from fastapi.testclient import TestClient
+    import json, server_orchestrator
+    publish_index(model, [("shared.pdf", f"card fees policy section {i}") for i in range(10)])
+    monkeypatch.setattr(registry, "_retriever", Retriever())
+
+    async def fake_llm(prompt):
+        return '{"answer": "ok", "citations": []}'
+    monkeypatch.setattr(agents, "acall_llm", fake_llm)
+    requests = [{"user_text": f"card fees question {i}"} for i in range(3)]
+    with TestClient(server_orchestrator.app) as client:
+        # no X-Debug-Timings header: batch lines carry timings anyway
+        lines = [json.loads(l) for l in client.post('/chat/batch', json={"requests": requests}).text.splitlines()]
+    assert sorted(l["index"] for l in lines) == [0, 1, 2]
+    for line in lines:
+        assert "result" in line and line["timings"]["total_s"] > 0 and "llm" in line["timings"]
@@ -0,0 +1,39 @@
+import shutil, threading, multiprocessing
+from pathlib import Path
+import pytest
+import chunker, ingest
+
+SAMPLE_PDF = Path(__file__).resolve().parents[1] / "pdfs" / "bank_accounts_detail.pdf"
+
+@pytest.fixture
+def pdf_folder(workdir, monkeypatch):
+    # whitespace tokens instead of the MiniLM tokenizer, which would have to come from the Hub
+    monkeypatch.setattr(chunker, "count_tokens", lambda text: len(text.split()))
+    folder = workdir / "pdfs"
+    folder.mkdir()
+    shutil.copy(SAMPLE_PDF, folder)
+    return folder
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_rebuild_keeps_index_type_and_storage(model, pdf_folder, incremental):
+    ingest.ingest_pdf_folder(pdf_folder, model=model, workers=1, cache=None, index_kind="hnsw", index_params={"storage": "sq8"})
+    (pdf_folder / "copy.pdf").write_bytes(SAMPLE_PDF.read_bytes())
+    report = ingest.ingest_pdf_folder(pdf_folder, model=model, workers=1, cache=None, incremental=incremental)
+    params = ingest.current_params()
+    assert report["index"] == params["kind"] == "hnsw" and params["storage"] == "sq8"
+    ingest.ingest_pdf_folder(pdf_folder, model=model, workers=1, cache=None, index_kind="flat", index_params={"storage": "fp32"})
+    assert ingest.current_params()["kind"] == "flat"
+
+class FailingModel:
+    def encode(self, sentences, **kwargs):
+        raise RuntimeError("embedding failed")
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_failed_embedding_stops_producer(pdf_folder, workers):
+    for i in range(3):
+        (pdf_folder / f"copy{i}.pdf").write_bytes(SAMPLE_PDF.read_bytes())
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        ingest.run_pipeline(sorted(pdf_folder.glob("*.pdf")), FailingModel(), batch_size=1, workers=workers,
+                            queue_depth=1, cache=None)
+    assert not [t for t in threading.enumerate() if t.name == "ingest-producer"]
+    assert not multiprocessing.active_children()
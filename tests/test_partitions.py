@@ -0,0 +1,29 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from retriever import Retriever, visible_partitions
+from conftest import publish_index
+
+CHUNKS = [("shared.pdf", f"card fees and charges policy section {i}") for i in range(40)] + \
+         [("acct1/own.pdf", f"card fees for account one statement {i}") for i in range(20)] + \
+         [("acct2/own.pdf", f"card fees for account two statement {i}") for i in range(20)]
+
+@pytest.mark.parametrize("kind, params", [("flat", {}), ("hnsw", {}), ("ivf", {"nlist": 2, "nprobe": 2}),
+                                          ("flat", {"storage": "pq", "m": 8})])
+def test_search_only_sees_visible_partitions(model, workdir, kind, params):
+    publish_index(model, CHUNKS, kind, **params)
+    ret = Retriever()
+    for account, allowed in [(None, {""}), ("acct1", {"", "acct1"}), ("nobody", {""})]:
+        metas = ret.retrieve("card fees account statement", top_k=10, min_score=0, partitions=visible_partitions(account))
+        assert metas and {m['partition'] for m in metas} <= allowed
+
+@pytest.mark.parametrize("kind", ["flat", "hnsw", "ivf"])
+def test_concurrent_partition_searches(model, workdir, kind):
+    # every search must get its own SearchParameters: IndexIDMap swaps params.sel during a call
+    publish_index(model, CHUNKS, kind, **({"nlist": 2, "nprobe": 2} if kind == "ivf" else {}))
+    ret = Retriever(hybrid=False)
+    q_emb = ret.embed("card fees for account one")
+    partitions = visible_partitions("acct1")
+    expected = [m['vid'] for m in ret.search(q_emb, 10, 0, partitions)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: [m['vid'] for m in ret.search(q_emb, 10, 0, partitions)], range(2000)))
+    assert all(r == expected for r in results)
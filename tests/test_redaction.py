@@ -0,0 +1,29 @@
+import random
+import pytest
+import bench_redaction
+from bench_redaction import legacy_redact_pii, PATHOLOGICAL, timed
+from redaction import redact_pii
+
+def test_card_after_digit_prefix():
+    assert redact_pii("ref 12 4111 1111 1111 1111 please") == \
+        ("ref 12 <CARD_MASK>_1 please", {"<CARD_MASK>_1": "4111 1111 1111 1111"})
+
+def test_non_luhn_run_still_masked():
+    # fails Luhn and holds no SSN or phone: masked as a card, like the legacy redactor
+    assert redact_pii("acct 1234567890123456 x") == ("acct <CARD_MASK>_1 x", {"<CARD_MASK>_1": "1234567890123456"})
+    assert redact_pii("acct 1234567890123456 x") == legacy_redact_pii("acct 1234567890123456 x")
+
+def test_keys_match_legacy():
+    rng = random.Random(0)
+    for _ in range(500):
+        text = bench_redaction.message(rng)
+        assert redact_pii(text) == legacy_redact_pii(text)
+    text = "mail a@b.com, card 4111111111111111, call 9876543210, ssn 123-45-6789"
+    assert redact_pii(text) == legacy_redact_pii(text)
+
+def test_round_trip():
+    assert bench_redaction.fuzz(2_000)
+
+@pytest.mark.parametrize("name", PATHOLOGICAL)
+def test_bounded_time(name):
+    assert timed(redact_pii, PATHOLOGICAL[name](100_000), 1) < 2.0
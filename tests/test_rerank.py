@@ -0,0 +1,25 @@
+import registry
+from agents import AnswerAgent
+from reranker import Reranker
+
+class FakeCrossEncoder:
+    def __init__(self, scores):
+        self.scores = scores
+
+    def predict(self, pairs, **kwargs):
+        return [self.scores[text] for _, text in pairs]
+
+def chunk(source, index, score):
+    text = f"{source} chunk {index}. " + "policy wording " * 150
+    return {"id": f"{source}-{index}", "source": source, "chunk_index": index, "score": score, "text": text}
+
+def test_prompt_follows_rerank_order(monkeypatch):
+    metas = [chunk("sbi.pdf", 2, 0.9), chunk("sbi.pdf", 7, 0.8), chunk("hsdc.pdf", 6, 0.5)]
+    encoder = FakeCrossEncoder({metas[0]['text']: 0.1, metas[1]['text']: 0.5, metas[2]['text']: 0.9})
+    monkeypatch.setitem(registry._models, ("cross-encoder", "fake"), encoder)
+    reranked, _ = Reranker("fake").rerank("card fees", metas)
+    prompt = AnswerAgent.build_prompt("card fees", reranked)
+    order = [line for line in prompt.splitlines() if line.startswith("Source:")]
+    # the cross-encoder's best chunk comes first and is never the one the token budget cuts
+    assert order[0] == "Source: hsdc.pdf (chunk 6)"
+    assert order[1:] == ["Source: sbi.pdf (chunk 7)", "Source: sbi.pdf (chunk 2)"][:len(order) - 1]
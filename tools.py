@@ -1,14 +1,133 @@
-import requests
+import time, asyncio, threading, requests, httpx
+from requests.adapters import HTTPAdapter
+from metrics import Histogram
+import tracing
 FASTAPI_BASE = 'http://127.0.0.1:8001'
 
+POOL_SIZE = 64
+# per-endpoint request timeouts in seconds (connect, read)
+TIMEOUTS = {
+    "/block_card":    (1.0, 5.0),
+    "/raise_dispute": (1.0, 5.0),
+    "/get_balance":   (1.0, 2.0),
+}
+# only idempotent calls are retried; blocking a card or raising a dispute twice is not safe
+RETRIES = {"/get_balance": 2}
+BACKOFF_S = 0.1
+BREAKER_FAILURES = 5
+BREAKER_RESET_S = 30.0
+
+TOOL_LATENCY = Histogram("tool_latency_seconds", "Banking API call latency by endpoint and outcome")
+
+class CircuitBreaker:
+    """Fails fast after `failures` consecutive errors, then lets one trial call through every reset_s."""
+    def __init__(self, failures=BREAKER_FAILURES, reset_s=BREAKER_RESET_S):
+        self.failures = failures
+        self.reset_s = reset_s
+        self.consecutive = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_s:
+                self.opened_at = time.monotonic()  # half-open: this caller is the trial
+                return True
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.consecutive = 0
+                self.opened_at = None
+            else:
+                self.consecutive += 1
+                if self.consecutive >= self.failures:
+                    self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return "closed" if self.opened_at is None else "open"
+
+breaker = CircuitBreaker()
+
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE))
+# shared by every async tool call so connections to the banking API are reused
+_aclient = httpx.AsyncClient(base_url=FASTAPI_BASE, limits=httpx.Limits(
+    max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE))
+
+def _unavailable(path, reason):
+    return {"status": "error", "error": f"banking service unavailable ({path}: {reason})"}
+
+def _post(path, payload):
+    if not breaker.allow():
+        return _unavailable(path, "circuit open")
+    attempts = RETRIES.get(path, 0) + 1
+    for attempt in range(attempts):
+        t0 = time.perf_counter()
+        try:
+            with tracing.span("tool_http"):
+                r = _session.post(f"{FASTAPI_BASE}{path}", json=payload, timeout=TIMEOUTS[path])
+            ok = r.status_code < 500
+        except (requests.ConnectionError, requests.Timeout) as e:
+            r, ok = e, False
+        TOOL_LATENCY.observe(time.perf_counter() - t0, endpoint=path, outcome="ok" if ok else "error")
+        breaker.record(ok)
+        if ok:
+            return r.json()
+        if attempt + 1 < attempts and breaker.allow():
+            time.sleep(BACKOFF_S * 2 ** attempt)
+        else:
+            break
+    return _unavailable(path, type(r).__name__ if isinstance(r, Exception) else f"HTTP {r.status_code}")
+
+async def _apost(path, payload):
+    if not breaker.allow():
+        return _unavailable(path, "circuit open")
+    connect, read = TIMEOUTS[path]
+    attempts = RETRIES.get(path, 0) + 1
+    for attempt in range(attempts):
+        t0 = time.perf_counter()
+        try:
+            with tracing.span("tool_http"):
+                r = await _aclient.post(path, json=payload, timeout=httpx.Timeout(read, connect=connect))
+            ok = r.status_code < 500
+        except httpx.TransportError as e:
+            r, ok = e, False
+        TOOL_LATENCY.observe(time.perf_counter() - t0, endpoint=path, outcome="ok" if ok else "error")
+        breaker.record(ok)
+        if ok:
+            return r.json()
+        if attempt + 1 < attempts and breaker.allow():
+            await asyncio.sleep(BACKOFF_S * 2 ** attempt)
+        else:
+            break
+    return _unavailable(path, type(r).__name__ if isinstance(r, Exception) else f"HTTP {r.status_code}")
+
 def tool_block_card(account_id, card_last4, reason):
-    r = requests.post(f"{FASTAPI_BASE}/block_card", json={"account_id":account_id,"card_last4":card_last4,"reason":reason})
-    return r.json()
+    return _post("/block_card", {"account_id":account_id,"card_last4":card_last4,"reason":reason})
 
 def tool_raise_dispute(account_id, transaction_id, reason):
-    r = requests.post(f"{FASTAPI_BASE}/raise_dispute", json={"account_id":account_id,"transaction_id":transaction_id,"reason":reason})
-    return r.json()
+    return _post("/raise_dispute", {"account_id":account_id,"transaction_id":transaction_id,"reason":reason})
 
 def tool_get_balance(account_id):
-    r = requests.post(f"{FASTAPI_BASE}/get_balance", json={"account_id":account_id})
-    return r.json()
+    return _post("/get_balance", {"account_id":account_id})
+
+async def atool_block_card(account_id, card_last4, reason):
+    return await _apost("/block_card", {"account_id":account_id,"card_last4":card_last4,"reason":reason})
+
+async def atool_raise_dispute(account_id, transaction_id, reason):
+    return await _apost("/raise_dispute", {"account_id":account_id,"transaction_id":transaction_id,"reason":reason})
+
+async def atool_get_balance(account_id):
+    return await _apost("/get_balance", {"account_id":account_id})
+
+def stats():
+    return {"circuit_breaker": breaker.state, "latency": TOOL_LATENCY.snapshot()}
+
+async def aclose():
+    await _aclient.aclose()
+    _session.close()
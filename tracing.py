@@ -0,0 +1,130 @@
+import os, time, functools, contextvars
+from contextlib import contextmanager, nullcontext
+from metrics import Histogram
+
+# requests with this header (any value but "0") get a "timings" block: seconds per stage plus total_s
+DEBUG_HEADER = "X-Debug-Timings"
+# e.g. http://127.0.0.1:4317 to also export every span to a local OpenTelemetry collector (OTLP/gRPC);
+# needs `pip install opentelemetry-sdk opentelemetry-exporter-otlp`
+OTEL_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "bank-chatbot-orchestrator")
+
+STAGE_LATENCY = Histogram("chat_stage_seconds", "Time spent per request stage (classify_intent, embed, faiss_search, llm, ...)")
+REQUEST_LATENCY = Histogram("chat_request_seconds", "End-to-end request time by endpoint")
+
+_timings = contextvars.ContextVar("timings", default=None)
+_tracer = None
+_provider = None
+_otel_trace = None
+
+class Span:
+    __slots__ = ("name", "seconds")
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+
+@contextmanager
+def span(name):
+    """Time a stage: always into STAGE_LATENCY, into the current request's timings, and as an OpenTelemetry span when exporting.
+
+    Yields a Span whose seconds are set on exit, for callers that need the duration themselves.
+    Costs two perf_counter() calls and a histogram update when OpenTelemetry is off.
+    A stage entered more than once in a request (e.g. two embed calls) adds up.
+    """
+    s = Span(name)
+    t0 = time.perf_counter()
+    try:
+        with _tracer.start_as_current_span(name) if _tracer is not None else nullcontext():
+            yield s
+    finally:
+        s.seconds = time.perf_counter() - t0
+        record(name, s.seconds)
+
+def record(name, seconds):
+    """Account a stage timed by the caller (e.g. one spread across an async generator's yields); no OpenTelemetry span."""
+    STAGE_LATENCY.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def annotate(key, value):
+    """Attach a non-timing value (e.g. prompt_tokens) to the current request's timings and span."""
+    timings = _timings.get()
+    if timings is not None:
+        timings[key] = value
+    if _tracer is not None:
+        _otel_trace.get_current_span().set_attribute(key, value)
+
+def traced(name):
+    """Decorator running a (sync) function inside span(name)."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+@contextmanager
+def request(endpoint):
+    """Trace one request; yields its timings dict, which gets total_s on exit.
+
+    Spans on other threads only land in it when the work was submitted through bind().
+    May wrap the body of a streaming response's generator.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    t0 = time.perf_counter()
+    try:
+        with _tracer.start_as_current_span(endpoint) if _tracer is not None else nullcontext():
+            yield timings
+    finally:
+        timings["total_s"] = time.perf_counter() - t0
+        REQUEST_LATENCY.observe(timings["total_s"], endpoint=endpoint)
+        try:
+            _timings.reset(token)
+        except ValueError:  # a generator abandoned mid-stream is closed from another context
+            pass
+
+@contextmanager
+def branch():
+    """Own timings for one item of a batch, starting from the stages recorded so far (e.g. the shared retrieval)."""
+    parent = _timings.get()
+    timings = dict(parent) if parent is not None else {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+def bind(fn):
+    """fn to run in the caller's context, so its spans on an executor thread join the caller's trace."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+def setup_otel(endpoint=OTEL_ENDPOINT):
+    """Start exporting spans to endpoint; returns whether export is on."""
+    global _tracer, _provider, _otel_trace
+    if not endpoint:
+        return False
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        print(f"OpenTelemetry export disabled ({e}); pip install opentelemetry-sdk opentelemetry-exporter-otlp")
+        return False
+    _provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # spans are sent from a background thread in batches, never on the request path
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint, insecure=True)))
+    trace.set_tracer_provider(_provider)
+    _tracer, _otel_trace = trace.get_tracer("orchestrator"), trace
+    print(f"Exporting traces to {endpoint}")
+    return True
+
+def shutdown_otel():
+    """Flush spans still queued for export."""
+    if _provider is not None:
+        _provider.shutdown()